@@ -0,0 +1,66 @@
+import logging
+from typing import Callable, List
+
+from sqlalchemy import event
+
+from .database import SessionLocal
+
+log = logging.getLogger(__name__)
+
+# Los parsers "anotan" en la sesión lo que escriben (db.info) y, solo cuando el
+# commit se confirma, se notifica a los componentes en memoria que lo necesitan.
+# Si la transacción hace rollback, lo anotado se descarta.
+_PENDING_KEY = "pending_changes"
+
+_listeners: List[Callable[[list], None]] = []
+
+
+def track(db, kind: str, **payload):
+    """Anota un cambio pendiente de commit. 'kind' identifica la tabla/sección afectada."""
+    db.info.setdefault(_PENDING_KEY, []).append({"kind": kind, **payload})
+
+
+def execute_tracked(db, stmt, model):
+    """
+    Ejecuta un INSERT/UPSERT/UPDATE con RETURNING de la fila completa y anota las filas
+    resultantes (tal y como quedaron en BBDD) para el read model en memoria.
+    Con ON CONFLICT DO NOTHING solo vuelven las filas realmente insertadas.
+    """
+    result = db.execute(stmt.returning(*model.__table__.columns))
+    rows = [dict(row._mapping) for row in result]
+    if rows:
+        track(db, "rows", table=model.__tablename__, rows=rows)
+    return rows
+
+
+def on_commit(listener: Callable[[list], None]):
+    """Registra un listener que recibe la lista de cambios confirmados (usable como decorador)."""
+    _listeners.append(listener)
+    return listener
+
+
+def pending(db) -> list:
+    """Cambios anotados en la sesión y aún no confirmados."""
+    return db.info.get(_PENDING_KEY, [])
+
+
+def dispatch(batch: list):
+    """Entrega un lote confirmado a los listeners (commits locales o de otro worker, vía app.notify)."""
+    for listener in _listeners:
+        try:
+            listener(batch)
+        except Exception as e:
+            # Un listener roto no puede tumbar una ingesta ya confirmada en BBDD.
+            log.error(f"Error en listener post-commit {getattr(listener, '__name__', listener)}: {e}", exc_info=True)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _dispatch_after_commit(session):
+    batch = session.info.pop(_PENDING_KEY, None)
+    if batch:
+        dispatch(batch)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,52 @@
+import gzip
+import logging
+import os
+from typing import Optional
+
+try:
+    import brotli # Opcional: sin el paquete 'brotli' solo se ofrece gzip
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+# Por debajo de este tamaño no compensa comprimir.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+# Orden de preferencia cuando el cliente acepta varias con el mismo peso.
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Elige 'br' o 'gzip' según la cabecera Accept-Encoding (None = sin comprimir)."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        # mtime=0: la misma entrada produce siempre los mismos bytes
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
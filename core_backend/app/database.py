@@ -1,7 +1,7 @@
 import os
 import logging
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.pool import QueuePool
 
@@ -43,6 +43,29 @@ DB_NAME = os.getenv("DB_NAME")
 # Construct the database URL
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?client_encoding=utf8"
 
+# Optional read-only connection settings for graphics reads (/all-data, GET endpoints).
+# - DB_READ_URL: full DSN of a streaming replica (takes precedence).
+# - DB_READ_HOST / DB_READ_PORT: replica host/port, reusing the primary credentials.
+# When none are set, reads use a dedicated pool against the primary so that readers
+# never compete with the ingest writers for the same connections.
+DB_READ_URL = os.getenv("DB_READ_URL")
+DB_READ_HOST = os.getenv("DB_READ_HOST")
+DB_READ_PORT = os.getenv("DB_READ_PORT") or DB_PORT
+
+if DB_READ_URL:
+    READ_DATABASE_URL = DB_READ_URL
+elif DB_READ_HOST:
+    READ_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_READ_HOST}:{DB_READ_PORT}/{DB_NAME}?client_encoding=utf8"
+else:
+    READ_DATABASE_URL = DATABASE_URL
+
+# Opt-in: LIVE DT_RESULT states go to an UNLOGGED table (no WAL) and only
+# UNOFFICIAL/OFFICIAL states are promoted into the durable 'results' table.
+LIVE_RESULTS_UNLOGGED = os.getenv("LIVE_RESULTS_UNLOGGED", "false").lower() in ("1", "true", "yes")
+
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "5"))
+READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", "10"))
+
 # --- SQLAlchemy Engine Setup ---
 engine = create_engine(
     DATABASE_URL,
@@ -51,8 +74,20 @@ engine = create_engine(
     max_overflow=10
 )
 
+# Read engine: separate pool, read-only transactions (works against replicas too).
+read_engine = create_engine(
+    READ_DATABASE_URL,
+    poolclass=QueuePool,
+    pool_size=READ_POOL_SIZE,
+    max_overflow=READ_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    execution_options={"postgresql_readonly": True},
+)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
 
 
@@ -63,3 +98,82 @@ def get_db_session():
         yield db
     finally:
         db.close()
+
+
+def get_read_db_session():
+    """Session for read-only endpoints. Never used by the ingest/processing path."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# --- Schema upgrades for databases created before these columns/constraints existed ---
+# create_all() only creates missing tables; existing ones need the DDL below (idempotent).
+SCHEMA_UPGRADES = (
+    "ALTER TABLE records ADD COLUMN IF NOT EXISTS time_hs INTEGER",
+    "ALTER TABLE results ADD COLUMN IF NOT EXISTS time_hs INTEGER",
+    "ALTER TABLE results ADD COLUMN IF NOT EXISTS diff_hs INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_results_unit_time ON results (unit_id, time_hs)",
+    # Indexes behind the scoped read endpoints (/units, /events, /participants, /schedule/now-next)
+    "CREATE INDEX IF NOT EXISTS ix_schedule_event_id ON schedule (event_id)",
+    "CREATE INDEX IF NOT EXISTS ix_schedule_start_time ON schedule (start_time)",
+    "CREATE INDEX IF NOT EXISTS ix_start_list_participant ON start_list_entries (participant_id)",
+    "CREATE INDEX IF NOT EXISTS ix_results_participant ON results (participant_id)",
+    "CREATE INDEX IF NOT EXISTS ix_medallists_participant ON medallists (participant_id)",
+    # Bare integers (points, places) were once parsed as seconds: they are not times
+    "UPDATE records SET time_hs = NULL WHERE time_hs IS NOT NULL AND time !~ '[.:]'",
+    "UPDATE results SET time_hs = NULL WHERE time_hs IS NOT NULL AND time !~ '[.:]'",
+    "UPDATE results SET diff_hs = NULL WHERE diff_hs IS NOT NULL AND diff !~ '[.:]'",
+    "UPDATE live_results SET time_hs = NULL WHERE time_hs IS NOT NULL AND time !~ '[.:]'",
+    "UPDATE live_results SET diff_hs = NULL WHERE diff_hs IS NOT NULL AND diff !~ '[.:]'",
+    "UPDATE splits SET value_hs = NULL WHERE value_hs IS NOT NULL AND value !~ '[.:]'",
+)
+
+
+def _add_record_constraint(conn):
+    """
+    Add uq_record (the ON CONFLICT target of parser_records) to a records table created without it.
+    Duplicated (event_id, record_type) rows are removed first: the one with the latest year
+    (then the latest inserted) is kept, and every removed row is logged so it can be restored by hand.
+    """
+    if conn.execute(text("SELECT 1 FROM pg_constraint WHERE conname = 'uq_record'")).first():
+        return
+    duplicates = conn.execute(text("""
+        SELECT record_id, event_id, record_type, time, holder_name, holder_noc, year
+          FROM (SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY event_id, record_type ORDER BY year DESC NULLS LAST, record_id DESC
+                ) AS position
+                  FROM records) ranked
+         WHERE position > 1
+    """)).fetchall()
+    for row in duplicates:
+        logger.warning("Schema upgrade: removing duplicate record before adding uq_record: %s", dict(row._mapping))
+    if duplicates:
+        conn.execute(text("DELETE FROM records WHERE record_id = ANY(:ids)"),
+                     {"ids": [row.record_id for row in duplicates]})
+    conn.execute(text("ALTER TABLE records ADD CONSTRAINT uq_record UNIQUE (event_id, record_type)"))
+    logger.info("Schema upgrade: added uq_record (%d duplicate records removed)", len(duplicates))
+
+
+def upgrade_schema():
+    """Apply SCHEMA_UPGRADES, add uq_record and backfill records.time_hs (used by record detection)."""
+    if engine.dialect.name != "postgresql":
+        return
+    from .parsers.time_helpers import time_to_hundredths
+
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
+        _add_record_constraint(conn)
+        missing = conn.execute(text(
+            "SELECT record_id, time FROM records WHERE time_hs IS NULL AND time IS NOT NULL"
+        )).fetchall()
+        for record_id, value in missing:
+            hundredths = time_to_hundredths(value)
+            if hundredths is not None:
+                conn.execute(text("UPDATE records SET time_hs = :hs WHERE record_id = :id"),
+                             {"hs": hundredths, "id": record_id})
+    if missing:
+        logger.info("Schema upgrade: backfilled time_hs for %d records", len(missing))
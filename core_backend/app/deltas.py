@@ -0,0 +1,365 @@
+import asyncio
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from typing import List, Optional
+
+from . import changes
+from .json_generator import encode_json
+from .on_air import focus as on_air
+from .read_model import model as read_model
+from .reference_bundles import BUNDLES, bundles as reference_bundles
+from .shared_snapshot import broadcast, shared
+from .snapshot_cache import cache as snapshot_cache, invalidated_sections, sections_for_change
+from .websockets import manager
+from .widget_payloads import WIDGET_SECTIONS, affected_units_and_events, payloads as widget_payloads
+
+log = logging.getLogger(__name__)
+
+# Deltas recientes que se guardan para reenviar a un cliente que se ha saltado versiones.
+DELTA_LOG_SIZE = int(os.getenv("DELTA_LOG_SIZE", "1000"))
+# Ventana de agrupación: los commits dentro de ella salen en un único delta por topic (0 = sin ventana).
+WS_COALESCE_MS = float(os.getenv("WS_COALESCE_MS", "150"))
+# Long-polling de /changes: espera máxima (segundos) de una petición sin cambios.
+CHANGES_MAX_WAIT = float(os.getenv("CHANGES_MAX_WAIT", "30"))
+
+# Secciones de /all-data que el delta reemplaza por unidad (filas completas de la unidad).
+UNIT_SECTIONS = {
+    "results": "results",
+    "live_results": "results",
+    "splits": "results", # Parciales LIVE: van dentro de las filas de resultados de la unidad
+    "start_list_entries": "start_list",
+}
+# Secciones que el propio delta ya actualiza: el cliente no tiene que volver a pedirlas.
+# Las de widgets, con los payloads de las unidades / pruebas tocadas ('widgets').
+COVERED_SECTIONS = {"results", "start_list", "medallists", "meta", "meta_bundles"} | set(WIDGET_SECTIONS)
+# Topics fijos -> sección de /all-data cuyo contenido llevan.
+SECTION_TOPICS = {"medal_tally": "medal_tally", "schedule": "timetable"}
+
+
+def build_delta(batch: list) -> Optional[dict]:
+    """
+    Traduce un lote confirmado a cambios de /all-data:
+    - results / start_list: filas completas de cada unidad tocada (reemplazan a las anteriores).
+    - medallists: filas nuevas o actualizadas (clave event_id + participant_id).
+    - widgets: payloads de widgets de las unidades / pruebas tocadas ({"units": {id: {...}}, "events": ...}),
+      que reemplazan su entrada en cada sección de widgets.
+    - sections: secciones derivadas (medallero, timetable...) que hay que volver a pedir.
+    - bundles: hashes nuevos si cambió algún dato de referencia.
+    """
+    unit_sections = {}
+    medallists = {}
+    sections = set()
+    reloaded = set()
+    bundles_changed = False
+    for change in batch:
+        sections |= sections_for_change(change)
+        table = change.get("table")
+        if table in BUNDLES.values():
+            bundles_changed = True
+        if table in UNIT_SECTIONS:
+            section = UNIT_SECTIONS[table]
+            if change["kind"] == "rows":
+                unit_ids = {row.get("unit_id") for row in change["rows"]}
+            elif change["kind"] == "delete":
+                unit_ids = {change["match"].get("unit_id")}
+            else:
+                reloaded.add(section) # Tabla recargada entera: el cliente vuelve a pedir la sección
+                continue
+            for unit_id in unit_ids - {None}:
+                unit_sections[(section, unit_id)] = None
+        elif table == "medallists" and change["kind"] == "rows":
+            for row in change["rows"]:
+                medallists[(row.get("event_id"), row.get("participant_id"))] = row
+
+    delta_changes = []
+    for section, unit_id in unit_sections:
+        rows = read_model.unit_results(unit_id) if section == "results" \
+            else read_model.unit_rows("start_list_entries", unit_id)
+        delta_changes.append({"section": section, "unit_id": unit_id, "rows": rows})
+    if medallists:
+        delta_changes.append({"section": "medallists", "rows": list(medallists.values())})
+
+    widgets = None
+    affected = affected_units_and_events(batch)
+    if affected is not None and (affected[0] or affected[1]):
+        unit_ids, event_ids = set(affected[0]), set(affected[1])
+        for unit_id in unit_ids:
+            unit = read_model.get("schedule", unit_id)
+            if unit and unit.get("event_id"):
+                event_ids.add(unit["event_id"]) # Resumen de fases / medallas de su prueba
+        widgets = {
+            "units": {unit_id: widget_payloads.unit(unit_id) for unit_id in sorted(unit_ids)},
+            "events": {event_id: widget_payloads.event(event_id) for event_id in sorted(event_ids)},
+        }
+
+    # Un cambio global (participantes, NOCs, recargas) sí deja obsoletas las secciones de widgets enteras
+    sections -= COVERED_SECTIONS if affected is not None else COVERED_SECTIONS - set(WIDGET_SECTIONS)
+    sections |= reloaded
+    if not delta_changes and not widgets and not sections and not bundles_changed:
+        return None
+    delta = {"changes": delta_changes, "sections": sorted(sections)}
+    if widgets:
+        delta["widgets"] = widgets
+    if bundles_changed:
+        delta["bundles"] = reference_bundles.refs()
+    return delta
+
+
+def _update_message(topic: str, version: int, **payload) -> str:
+    return encode_json({"type": "update", "topic": topic, "version": version, **payload}).decode("utf-8")
+
+
+def _section_message(topic: str, version: int, section: str) -> str:
+    # El blob de la sección ya está serializado en la caché de snapshot: se incrusta tal cual
+    _, blob = snapshot_cache.section_bytes(section)
+    head = encode_json({"type": "update", "topic": topic, "version": version, "section": section})
+    return (head[:-1] + b',"data":' + blob + b"}").decode("utf-8")
+
+
+def topic_updates(batch: list, delta: Optional[dict], version: int) -> list:
+    """
+    Mensajes (mensaje, topics) para los clientes suscritos a topics concretos.
+    Solo se construyen los de topics con algún suscriptor.
+    """
+    updates = []
+    delta_changes = delta["changes"] if delta else []
+
+    affected = affected_units_and_events(batch)
+    if affected is None:
+        # Cambio global (participantes, NOCs, pruebas): afecta a todo lo suscrito
+        unit_ids, event_ids = manager.subscribed_values("unit"), manager.subscribed_values("event")
+    else:
+        unit_ids, event_ids = set(affected[0]), set(affected[1])
+        for unit_id in unit_ids:
+            unit = read_model.get("schedule", unit_id)
+            if unit and unit.get("event_id"):
+                event_ids.add(unit["event_id"])
+
+    for unit_id in sorted(unit_ids):
+        topic = f"unit:{unit_id}"
+        if manager.has_subscribers(topic):
+            updates.append((_update_message(
+                topic, version,
+                changes=[c for c in delta_changes if c.get("unit_id") == unit_id],
+                widgets=widget_payloads.unit(unit_id),
+            ), (topic,)))
+    for event_id in sorted(event_ids):
+        topic = f"event:{event_id}"
+        if manager.has_subscribers(topic):
+            medallists = [
+                {"section": c["section"], "rows": [r for r in c["rows"] if r.get("event_id") == event_id]}
+                for c in delta_changes if c["section"] == "medallists"
+            ]
+            updates.append((_update_message(
+                topic, version,
+                changes=[c for c in medallists if c["rows"]],
+                widgets=widget_payloads.event(event_id),
+            ), (topic,)))
+
+    sections = set()
+    for change in batch:
+        sections |= invalidated_sections(change) # widget:<sección> lleva la sección completa
+    for topic, section in SECTION_TOPICS.items():
+        if section in sections and manager.has_subscribers(topic):
+            updates.append((_section_message(topic, version, section), (topic,)))
+    for section in sorted(sections):
+        topic = f"widget:{section}"
+        if section != "meta_bundles" and manager.has_subscribers(topic):
+            updates.append((_section_message(topic, version, section), (topic,)))
+    return updates
+
+
+class DeltaLog:
+    """
+    Numeración de los deltas y registro acotado de los últimos enviados.
+
+    - Cada lote confirmado que afecta a /all-data genera un delta con versión consecutiva
+      ('base' = versión anterior): un hueco le indica al cliente que ha perdido algo.
+    - 'boot' cambia en cada arranque: las versiones de otro proceso no son comparables.
+    - Con snapshot compartido, los lectores no numeran: reproducen los deltas del escritor
+      (mismo boot y versiones), así que un cliente puede cambiar de worker sin resync.
+    """
+
+    def __init__(self, size: int = DELTA_LOG_SIZE):
+        self._lock = threading.RLock()
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._log = deque(maxlen=size) # (versión, mensaje ya serializado)
+        self._waiters = [] # (bucle, asyncio.Event) de peticiones de /changes en long-polling
+
+    def append(self, delta: dict) -> str:
+        with self._lock:
+            self.version += 1
+            message = encode_json({
+                "type": "delta",
+                "boot": self.boot_id,
+                "version": self.version,
+                "base": self.version - 1,
+                **delta,
+            }).decode("utf-8")
+            self._log.append((self.version, message))
+            # Dentro del lock: los mensajes se encolan en el mismo orden que sus versiones
+            broadcast(message, boot=self.boot_id, version=self.version)
+            self._wake_waiters()
+        return message
+
+    def _wake_waiters(self):
+        for loop, event in self._waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def mirror(self, boot: str, version: Optional[int], topics: tuple, message: str):
+        """Reenvía a los clientes de este proceso un mensaje del worker escritor (version: si es un delta)."""
+        with self._lock:
+            if boot != self.boot_id:
+                self.adopt(boot, self.version if version is None else version - 1)
+            if version is not None:
+                self.version = version
+                self._log.append((version, message))
+            manager.publish(message, topics)
+            if version is not None:
+                self._wake_waiters()
+
+    def adopt(self, boot: str, version: int):
+        """Sigue la numeración del escritor desde 'version'; los clientes conectados recargan el snapshot."""
+        with self._lock:
+            self.boot_id = boot
+            self.version = version
+            self._log.clear()
+            manager.publish(self.resync_required())
+            self._wake_waiters() # /changes en espera responde resync_required
+
+    async def wait(self, version: int, timeout: float) -> bool:
+        """Espera (sin ocupar un hilo) a que haya un delta posterior a 'version'. False si vence el timeout."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            if self.version != version:
+                return True
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.remove(waiter)
+
+    def hello(self) -> str:
+        return encode_json({"type": "hello", "boot": self.boot_id, "version": self.version}).decode("utf-8")
+
+    def since(self, version: int, boot: str = None) -> Optional[List[str]]:
+        """Deltas posteriores a 'version', o None si ya no están en el registro (resync completo)."""
+        with self._lock:
+            if boot is not None and boot != self.boot_id:
+                return None
+            if version == self.version:
+                return []
+            if version > self.version or not self._log or self._log[0][0] > version + 1:
+                return None
+            return [message for v, message in self._log if v > version]
+
+    def changes(self, version: int, boot: str = None) -> str:
+        """Respuesta de /changes: los deltas posteriores a 'version', o resync_required."""
+        with self._lock:
+            missed = self.since(version, boot)
+            current = self.version # La misma que la del último delta incluido
+        if missed is None:
+            return self.resync_required()
+        head = encode_json({"type": "changes", "boot": self.boot_id, "version": current})
+        # Los deltas ya están serializados: se concatenan sin volver a codificarlos
+        return head[:-1].decode("utf-8") + ',"deltas":[' + ",".join(missed) + "]}"
+
+    def resync_required(self) -> str:
+        return encode_json({"type": "resync_required", "boot": self.boot_id, "version": self.version}).decode("utf-8")
+
+
+delta_log = DeltaLog()
+# A un cliente lento al que se le descartan mensajes se le pide un resync completo
+manager.resync_message = delta_log.resync_required
+
+# Snapshot compartido: los segmentos llevan el boot / versión de delta; los lectores reproducen los mensajes
+shared.delta_state = lambda: (delta_log.boot_id, delta_log.version)
+shared.on_message = delta_log.mirror
+shared.on_resync = delta_log.adopt
+
+
+@shared.on_promote
+def _restart_delta_numbering():
+    # Un lector que pasa a escritor no sabe si el anterior llegó a publicar algo más: boot nuevo
+    delta_log.adopt(uuid.uuid4().hex[:8], delta_log.version)
+
+
+def is_urgent(batch: list) -> bool:
+    """Resultados OFFICIAL, medallas y cambios de las unidades en antena salen sin esperar a la ventana de agrupación."""
+    if on_air.touched(batch):
+        return True
+    for change in batch:
+        table = change.get("table")
+        if table in ("medallists", "medaltally"):
+            return True
+        if table == "schedule" and change["kind"] == "rows" \
+                and any(row.get("status") == "OFFICIAL" for row in change["rows"]):
+            return True
+    return False
+
+
+def publish_batch(batch: list):
+    delta = build_delta(batch)
+    if delta is not None:
+        delta_log.append(delta)
+    for message, topics in topic_updates(batch, delta, delta_log.version):
+        broadcast(message, topics)
+
+
+class Coalescer:
+    """
+    Agrupa los lotes confirmados durante WS_COALESCE_MS y publica un único delta (y un
+    único update por topic) por ventana: una ráfaga de LIVE no provoca una ráfaga de refrescos.
+    Un lote urgente (is_urgent) vacía la ventana en el momento.
+    """
+
+    def __init__(self, window_ms: float = WS_COALESCE_MS):
+        self.window = window_ms / 1000
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # Un flush cada vez: las versiones salen en orden
+        self._pending = []
+        self._timer = None
+
+    def add(self, batch: list):
+        urgent = self.window <= 0 or is_urgent(batch)
+        with self._lock:
+            self._pending.extend(batch)
+            if not urgent and self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if urgent:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not batch:
+                return
+            try:
+                publish_batch(batch)
+            except Exception as e:
+                log.error(f"Error publicando delta: {e}", exc_info=True)
+
+
+coalescer = Coalescer()
+
+
+@changes.on_commit
+def _publish_committed_changes(batch: list):
+    if shared.is_reader:
+        return # Los deltas los construye el worker escritor (y llegan por app.shared_snapshot)
+    coalescer.add(batch)
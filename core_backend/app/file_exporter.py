@@ -0,0 +1,227 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, Optional
+
+from . import changes
+from .json_generator import encode_json
+from .read_model import SECTIONS, model as read_model
+from .snapshot_cache import cache as snapshot_cache, invalidated_sections
+from .widget_payloads import EVENT_WIDGETS, UNIT_WIDGETS, affected_units_and_events, payloads as widget_payloads
+
+log = logging.getLogger(__name__)
+
+# Ficheros para sistemas de playout que leen de disco. Sin directorio, el exportador no arranca.
+FILE_EXPORT_DIR = os.getenv("FILE_EXPORT_DIR", "")
+FILE_EXPORT_FORMATS = [f.strip().lower() for f in os.getenv("FILE_EXPORT_FORMATS", "json,xml,csv").split(",") if f.strip()]
+# Ventana de agrupación: una ráfaga de commits reescribe cada fichero una sola vez.
+FILE_EXPORT_DELAY_MS = float(os.getenv("FILE_EXPORT_DELAY_MS", "250"))
+# Windows no deja reemplazar un fichero que otro proceso tiene abierto: se reintenta.
+REPLACE_RETRIES = 5
+
+_XML_TAG = re.compile(r"[A-Za-z_][\w.-]*$")
+
+
+# --- Formatos ---
+
+def _xml_element(tag: str, value) -> ET.Element:
+    if _XML_TAG.match(tag):
+        element = ET.Element(tag)
+    else:
+        element = ET.Element("entry", key=tag) # Claves que no valen como etiqueta (ids, fases...)
+    if isinstance(value, dict):
+        for key, child in value.items():
+            element.append(_xml_element(str(key), child))
+    elif isinstance(value, list):
+        for child in value:
+            element.append(_xml_element("item", child))
+    elif value is not None:
+        element.text = str(value).lower() if isinstance(value, bool) else str(value)
+    return element
+
+
+def to_xml(name: str, data) -> bytes:
+    return ET.tostring(_xml_element(name, data), encoding="utf-8", xml_declaration=True)
+
+
+def _csv_rows(data) -> list:
+    # Lista de filas -> una línea por fila; {clave: filas} -> columna 'key' delante; un objeto -> una línea
+    if isinstance(data, list):
+        return [row if isinstance(row, dict) else {"value": row} for row in data]
+    if isinstance(data, dict) and data and all(isinstance(v, (dict, list)) for v in data.values()):
+        rows = []
+        for key, value in data.items():
+            for row in _csv_rows(value):
+                rows.append({"key": key, **row})
+        return rows
+    return [data] if data else []
+
+
+def _csv_cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")) # Miembros, splits...
+    return "" if value is None else value
+
+
+def to_csv(data) -> bytes:
+    rows = _csv_rows(data)
+    columns = []
+    for row in rows:
+        columns.extend(k for k in row if k not in columns)
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_cell(row.get(column)) for column in columns])
+    return out.getvalue().encode("utf-8")
+
+
+class FileExporter:
+    """
+    Escribe en FILE_EXPORT_DIR los datos de /all-data ya renderizados:
+      widgets/<sección>.<fmt>            una sección completa de /all-data
+      units/<unit_id>/<widget>.<fmt>     payload de un widget para una unidad
+      events/<event_id>/<widget>.<fmt>   payload de un widget para una prueba
+
+    - Escritura atómica: fichero temporal en el mismo directorio + os.replace. El playout
+      ve siempre la versión anterior completa o la nueva completa.
+    - Un fichero solo se reescribe si su contenido ha cambiado (hash del último escrito).
+    - Tras cada commit solo se regeneran las secciones, unidades y pruebas afectadas.
+    """
+
+    def __init__(self, directory: str = FILE_EXPORT_DIR, formats=FILE_EXPORT_FORMATS):
+        self.directory = directory
+        self.formats = [f for f in formats if f in ("json", "xml", "csv")]
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._everything = True # Primera pasada: exportación completa
+        self._sections, self._units, self._events = set(), set(), set()
+        self._digests: Dict[str, str] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not self.directory or self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        log.info(f"Exportando ficheros de datos ({', '.join(self.formats)}) en {self.directory}")
+        self._thread = threading.Thread(target=self._run, name="odf-file-exporter", daemon=True)
+        self._thread.start()
+        self._wake.set()
+
+    # --- Cambios pendientes ---
+
+    def mark(self, batch: list):
+        if self._thread is None:
+            return
+        affected = affected_units_and_events(batch)
+        with self._lock:
+            for change in batch:
+                self._sections |= invalidated_sections(change)
+            if affected is None:
+                self._everything = True
+            else:
+                self._units |= affected[0]
+                self._events |= affected[1]
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(FILE_EXPORT_DELAY_MS / 1000)
+            self._wake.clear()
+            with self._lock:
+                everything, self._everything = self._everything, False
+                sections, self._sections = self._sections, set()
+                units, self._units = self._units, set()
+                events, self._events = self._events, set()
+            try:
+                self.export(everything, sections, units, events)
+            except Exception as e:
+                log.error(f"Error exportando ficheros de datos: {e}", exc_info=True)
+
+    # --- Exportación ---
+
+    def export(self, everything: bool = True, sections=(), unit_ids=(), event_ids=()):
+        schedule = read_model.rows("schedule")
+        if everything:
+            sections = SECTIONS
+            unit_ids = {u["unit_id"] for u in schedule}
+            event_ids = {u.get("event_id") for u in schedule} | {m.get("event_id") for m in read_model.rows("medallists")}
+        else:
+            event_ids = set(event_ids)
+            for unit_id in unit_ids:
+                unit = read_model.get("schedule", unit_id)
+                if unit and unit.get("event_id"):
+                    event_ids.add(unit["event_id"]) # Resumen de fases y medallas de su prueba
+        written = 0
+        for section in sections:
+            if section in SECTIONS:
+                _, blob = snapshot_cache.section_bytes(section)
+                written += self._write_all(os.path.join("widgets", section), section, blob)
+        for unit_id in sorted(unit_ids):
+            payload = widget_payloads.unit(unit_id)
+            for widget in UNIT_WIDGETS:
+                written += self._write_all(os.path.join("units", unit_id, widget), widget, encode_json(payload[widget]))
+        for event_id in sorted(e for e in event_ids if e):
+            payload = widget_payloads.event(event_id)
+            for widget in EVENT_WIDGETS:
+                written += self._write_all(os.path.join("events", event_id, widget), widget, encode_json(payload[widget]))
+        if written:
+            log.debug(f"Exportación: {written} ficheros reescritos")
+        return written
+
+    def _write_all(self, relative: str, name: str, blob: bytes) -> int:
+        data = None
+        written = 0
+        for fmt in self.formats:
+            if fmt == "json":
+                content = blob
+            else:
+                if data is None:
+                    data = json.loads(blob)
+                content = to_xml(name, data) if fmt == "xml" else to_csv(data)
+            written += self._write(os.path.join(self.directory, f"{relative}.{fmt}"), content)
+        return written
+
+    def _write(self, path: str, content: bytes) -> bool:
+        digest = hashlib.sha1(content).hexdigest()
+        previous = self._digests.get(path)
+        if previous is None and os.path.exists(path):
+            with open(path, "rb") as f: # Fichero de una ejecución anterior
+                previous = hashlib.sha1(f.read()).hexdigest()
+        if previous == digest:
+            self._digests[path] = digest
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        for attempt in range(REPLACE_RETRIES):
+            try:
+                os.replace(tmp, path)
+                break
+            except PermissionError:
+                if attempt == REPLACE_RETRIES - 1:
+                    os.remove(tmp)
+                    log.warning(f"No se pudo reemplazar {path} (en uso): se reintentará en el próximo cambio")
+                    return False
+                time.sleep(0.05)
+        self._digests[path] = digest
+        return True
+
+
+exporter = FileExporter()
+
+
+@changes.on_commit
+def _export_committed_changes(batch: list):
+    exporter.mark(batch)
@@ -1,12 +1,274 @@
+import datetime
+import decimal
+import json
+import logging
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from . import models
+from . import models, database
+from .record_index import index as record_index
+
+log = logging.getLogger(__name__)
+
+# Filas por lote al leer con cursor de servidor en modo streaming
+STREAM_CHUNK_ROWS = 500
 
 def model_to_dict(obj):
     return {c.name: getattr(obj, c.name) for c in obj.__table__.columns}
 
-def generate_json(db: Session):
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode_json(value) -> bytes:
+    """Serialización compacta compatible con lo que devolvía el encoder por defecto de FastAPI."""
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def to_columnar(columns, rows):
+    """Codificación compacta: nombres de columna una sola vez + lista de valores por fila."""
+    return {"columns": list(columns), "rows": [list(r) for r in rows]}
+
+def query_table_columnar(db: Session, model):
+    """Tabla completa en formato columnar, leída con tuplas de SQLAlchemy Core (sin instanciar ORM)."""
+    columns = model.__table__.columns
+    rows = db.execute(select(*columns)).all()
+    return to_columnar([c.name for c in columns], rows)
+
+def splits_from_rows(split_rows):
+    """
+    Rearma el JSONB 'splits' del parser ({"team_splits": [...], "athlete_splits": {atleta: [...]}})
+    a partir de filas de la tabla 'splits' de un mismo participante.
+    """
+    splits = {"team_splits": [], "athlete_splits": {}}
+    for row in sorted(split_rows, key=lambda r: r["position"]):
+        pos = str(row["position"])
+        rank = str(row["rank"]) if row.get("rank") is not None else None
+        if row.get("athlete_id"):
+            splits["athlete_splits"].setdefault(row["athlete_id"], []).append(
+                {"Pos": pos, "Value": row.get("value"), "Rank": rank, "Value2": row.get("value2")}
+            )
+        else:
+            splits["team_splits"].append({"Pos": pos, "Value": row.get("value"), "Rank": rank, "Diff": row.get("diff")})
+    return splits
+
+def query_live_splits(db: Session, unit_ids=None):
+    """
+    Parciales de las filas de resultados sin JSONB 'splits' (LIVE: solo se escriben en la tabla
+    'splits'), como {(unit_id, participant_id): splits}. Una consulta indexada por unidad.
+    """
+    missing = set()
+    for model in (models.Result, models.LiveResult):
+        q = select(model.unit_id, model.participant_id).where(model.splits.is_(None))
+        if unit_ids is not None:
+            q = q.where(model.unit_id.in_(list(unit_ids)))
+        missing.update(tuple(row) for row in db.execute(q).all())
+    if not missing:
+        return {}
+    grouped = {}
+    q = select(*models.Split.__table__.columns).where(models.Split.unit_id.in_({unit_id for unit_id, _ in missing}))
+    for row in db.execute(q).all():
+        key = (row.unit_id, row.participant_id)
+        if key in missing:
+            grouped.setdefault(key, []).append(dict(row._mapping))
+    return {key: splits_from_rows(rows) for key, rows in grouped.items()}
+
+def query_results_columnar(db: Session):
+    """Como query_results, pero en formato columnar y con tuplas Core."""
+    columns = [c.name for c in models.Result.__table__.columns]
+    key_idx = (columns.index("unit_id"), columns.index("participant_id"))
+    splits_idx = columns.index("splits")
+    merged = {}
+    for model in (models.Result, models.LiveResult):
+        # Mismo orden de columnas en ambas tablas
+        for row in db.execute(select(*[model.__table__.c[name] for name in columns])).all():
+            merged[(row[key_idx[0]], row[key_idx[1]])] = row
+    live_splits = query_live_splits(db)
+    rows = []
+    for key, row in merged.items():
+        if row[splits_idx] is None and key in live_splits:
+            row = list(row)
+            row[splits_idx] = live_splits[key]
+        rows.append(row)
+    return to_columnar(columns, rows)
+
+def query_results(db: Session, unit_ids=None, participant_id: str = None):
+    """
+    Devuelve los resultados combinando 'results' (durable) y 'live_results' (UNLOGGED).
+    Un LIVE solo existe mientras no se ha promocionado, así que tiene prioridad.
+    Filtros opcionales por unidad(es) y participante (consultas indexadas).
+    """
+    merged = {}
+    for model in (models.Result, models.LiveResult):
+        q = db.query(model)
+        if unit_ids is not None:
+            q = q.filter(model.unit_id.in_(list(unit_ids)))
+        if participant_id:
+            q = q.filter(model.participant_id == participant_id)
+        for r in q.all():
+            merged[(r.unit_id, r.participant_id)] = model_to_dict(r)
+    if any(row["splits"] is None for row in merged.values()):
+        # Los LIVE no llevan JSONB: sus parciales vienen de la tabla 'splits'
+        live_splits = query_live_splits(db, unit_ids={unit_id for unit_id, _ in merged})
+        for key, row in merged.items():
+            if row["splits"] is None and key in live_splits:
+                row["splits"] = live_splits[key]
+    return list(merged.values())
+
+def query_participants(db: Session, participant_ids):
+    """Participantes por ID, como {participant_id: fila} (solo los que necesita el widget)."""
+    participant_ids = {p for p in participant_ids if p}
+    if not participant_ids:
+        return {}
+    rows = db.query(models.Participant).filter(models.Participant.participant_id.in_(participant_ids)).all()
+    return {p.participant_id: model_to_dict(p) for p in rows}
+
+def query_unit(db: Session, unit_id: str):
+    """Una unidad (serie/final): datos de schedule, start list, resultados y participantes implicados."""
+    unit = db.query(models.Schedule).filter(models.Schedule.unit_id == unit_id).first()
+    if unit is None:
+        return None
+    start_list = (
+        db.query(models.StartListEntry)
+        .filter(models.StartListEntry.unit_id == unit_id)
+        .order_by(models.StartListEntry.lane)
+        .all()
+    )
+    start_list = [model_to_dict(s) for s in start_list]
+    results = sorted(query_results(db, unit_ids=[unit_id]), key=lambda r: (r["rank"] is None, r["rank"] or 0))
+    participant_ids = {s["participant_id"] for s in start_list} | {r["participant_id"] for r in results}
+    return {
+        "unit": model_to_dict(unit),
+        "start_list": start_list,
+        "results": results,
+        "participants": query_participants(db, participant_ids),
+    }
+
+def query_event(db: Session, event_id: str):
+    """Una prueba: sus unidades y medallistas."""
+    event = db.query(models.Event).filter(models.Event.event_id == event_id).first()
+    if event is None:
+        return None
+    units = (
+        db.query(models.Schedule)
+        .filter(models.Schedule.event_id == event_id)
+        .order_by(models.Schedule.start_time)
+        .all()
+    )
+    medallists = [model_to_dict(m) for m in db.query(models.Medallist).filter(models.Medallist.event_id == event_id).all()]
+    return {
+        "event": model_to_dict(event),
+        "units": [model_to_dict(u) for u in units],
+        "medallists": medallists,
+        "participants": query_participants(db, {m["participant_id"] for m in medallists}),
+    }
+
+def query_participant(db: Session, participant_id: str):
+    """Un participante: sus entradas de start list, resultados y medallas."""
+    participant = db.query(models.Participant).filter(models.Participant.participant_id == participant_id).first()
+    if participant is None:
+        return None
+    entries = db.query(models.StartListEntry).filter(models.StartListEntry.participant_id == participant_id).all()
+    medallists = db.query(models.Medallist).filter(models.Medallist.participant_id == participant_id).all()
+    return {
+        "participant": model_to_dict(participant),
+        "start_list": [model_to_dict(e) for e in entries],
+        "results": query_results(db, participant_id=participant_id),
+        "medallists": [model_to_dict(m) for m in medallists],
+    }
+
+def query_schedule_window(db: Session, now: datetime.datetime = None, past_minutes: int = 30, next_count: int = 3):
+    """
+    Ventana "now/next" del schedule:
+    - now: unidades en curso (status LIVE) o que empezaron en los últimos 'past_minutes' y no son OFFICIAL.
+    - next: las 'next_count' siguientes unidades por start_time.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    since = now - datetime.timedelta(minutes=past_minutes)
+
+    current = (
+        db.query(models.Schedule)
+        .filter(
+            (models.Schedule.status == "LIVE")
+            | (
+                (models.Schedule.start_time >= since)
+                & (models.Schedule.start_time <= now)
+                & (models.Schedule.status != "OFFICIAL")
+            )
+        )
+        .order_by(models.Schedule.start_time)
+        .all()
+    )
+    upcoming = (
+        db.query(models.Schedule)
+        .filter(models.Schedule.start_time > now)
+        .order_by(models.Schedule.start_time)
+        .limit(next_count)
+        .all()
+    )
+    return {
+        "now": [model_to_dict(u) for u in current],
+        "next": [model_to_dict(u) for u in upcoming],
+    }
+
+def query_splits(db: Session, event_id: str = None, unit_id: str = None, position: int = None):
+    """
+    Parciales desde la tabla normalizada 'splits' (usa los índices por prueba/unidad + posición).
+    Ej: query_splits(db, event_id=..., position=50) -> todos los pasos de 50 m de la prueba.
+    """
+    q = db.query(models.Split)
+    if event_id:
+        q = q.filter(models.Split.event_id == event_id)
+    if unit_id:
+        q = q.filter(models.Split.unit_id == unit_id)
+    if position is not None:
+        q = q.filter(models.Split.position == position)
+    q = q.order_by(models.Split.unit_id, models.Split.position, models.Split.rank)
+    return [model_to_dict(s) for s in q.all()]
 
-    final_json = {
+def query_medal_tally(db: Session):
+    medal_tally_q = db.query(
+        models.MedalTally.rank,
+        models.Noc.flag_url_cloud,
+        models.MedalTally.noc,
+        models.Noc.long_name,
+        models.MedalTally.golds,
+        models.MedalTally.silvers,
+        models.MedalTally.bronzes,
+        models.MedalTally.total
+    ).join(models.Noc, models.MedalTally.noc == models.Noc.noc).order_by(models.MedalTally.rank).all()
+
+    return [
+        {
+            "rank": r[0],
+            "flag": r[1],
+            "noc": r[2],
+            "name": r[3],
+            "golds": r[4],
+            "silvers": r[5],
+            "bronzes": r[6],
+            "total": r[7],
+        } for r in medal_tally_q
+    ]
+
+def query_timetable(db: Session):
+    timetable_q = db.query(
+        models.Schedule.start_time,
+        models.Event.name,
+        models.Schedule.phase
+    ).join(models.Event, models.Schedule.event_id == models.Event.event_id).order_by(models.Schedule.start_time).all()
+
+    return [
+        {
+            "start_time": r[0].isoformat() if r[0] else None,
+            "event": r[1],
+            "phase": r[2]
+        } for r in timetable_q
+    ]
+
+def _empty_sections():
+    return {
         "countdown": {},
         "champ_title": {},
         "timetable": [],
@@ -29,52 +291,32 @@ def generate_json(db: Session):
         "meta": {},
     }
 
+def generate_json(db: Session, compact: bool = False):
+    """
+    Construye el JSON completo desde BBDD.
+    compact=True: 'results' y 'meta.participants' en formato columnar (ver to_columnar).
+    """
+
+    final_json = _empty_sections()
+
     try:
         final_json["tournament_info"] = model_to_dict(db.query(models.TournamentInfo).first())
     except Exception as e:
         final_json["tournament_info"] = {"error": str(e)}
 
     try:
-        medal_tally_q = db.query(
-            models.MedalTally.rank,
-            models.Noc.flag_url_cloud,
-            models.MedalTally.noc,
-            models.Noc.long_name,
-            models.MedalTally.golds,
-            models.MedalTally.silvers,
-            models.MedalTally.bronzes,
-            models.MedalTally.total
-        ).join(models.Noc, models.MedalTally.noc == models.Noc.noc).order_by(models.MedalTally.rank).all()
-
-        final_json["medal_tally"] = [
-            {
-                "rank": r[0],
-                "flag": r[1],
-                "noc": r[2],
-                "name": r[3],
-                "golds": r[4],
-                "silvers": r[5],
-                "bronzes": r[6],
-                "total": r[7],
-            } for r in medal_tally_q
-        ]
+        record_index.ensure_loaded(db)
+        final_json["new_record"] = record_index.new_record_section()
+    except Exception as e:
+        final_json["new_record"] = {"error": str(e)}
+
+    try:
+        final_json["medal_tally"] = query_medal_tally(db)
     except Exception as e:
         final_json["medal_tally"] = {"error": str(e)}
 
     try:
-        timetable_q = db.query(
-            models.Schedule.start_time,
-            models.Event.name,
-            models.Schedule.phase
-        ).join(models.Event, models.Schedule.event_id == models.Event.event_id).order_by(models.Schedule.start_time).all()
-
-        final_json["timetable"] = [
-            {
-                "start_time": r[0].isoformat() if r[0] else None,
-                "event": r[1],
-                "phase": r[2]
-            } for r in timetable_q
-        ]
+        final_json["timetable"] = query_timetable(db)
     except Exception as e:
         final_json["timetable"] = {"error": str(e)}
 
@@ -85,8 +327,7 @@ def generate_json(db: Session):
         final_json["start_list"] = {"error": str(e)}
 
     try:
-        results_q = db.query(models.Result).all()
-        final_json["results"] = [model_to_dict(r) for r in results_q]
+        final_json["results"] = query_results_columnar(db) if compact else query_results(db)
     except Exception as e:
         final_json["results"] = {"error": str(e)}
 
@@ -99,14 +340,147 @@ def generate_json(db: Session):
     try:
         events_q = db.query(models.Event).all()
         units_q = db.query(models.Schedule).all()
-        participants_q = db.query(models.Participant).all()
+        if compact:
+            participants = query_table_columnar(db, models.Participant)
+        else:
+            participants = [model_to_dict(p) for p in db.query(models.Participant).all()]
 
         final_json["meta"] = {
             "events": [model_to_dict(e) for e in events_q],
             "units": [model_to_dict(u) for u in units_q],
-            "participants": [model_to_dict(p) for p in participants_q],
+            "participants": participants,
         }
     except Exception as e:
         final_json["meta"] = {"error": str(e)}
 
     return final_json
+
+
+# --- Modo streaming ---
+
+def _stream_rows(db: Session, model, compact: bool, skip_keys=None, extra_rows=(), fill_splits=None):
+    """
+    Emite una tabla como array JSON (o bloque columnar) leyendo con cursor de servidor
+    (yield_per): la memoria queda acotada a un lote de filas.
+    skip_keys: claves (unit_id, participant_id) a omitir; extra_rows: tuplas a añadir al final;
+    fill_splits: {(unit_id, participant_id): splits} para las filas sin JSONB 'splits' (LIVE).
+    """
+    columns = [c.name for c in model.__table__.columns]
+    stmt = select(*model.__table__.columns).execution_options(yield_per=STREAM_CHUNK_ROWS)
+    if skip_keys or fill_splits:
+        key_idx = (columns.index("unit_id"), columns.index("participant_id"))
+    if fill_splits:
+        splits_idx = columns.index("splits")
+
+    def encode(row):
+        if fill_splits and row[splits_idx] is None and (row[key_idx[0]], row[key_idx[1]]) in fill_splits:
+            row = list(row)
+            row[splits_idx] = fill_splits[(row[key_idx[0]], row[key_idx[1]])]
+        return encode_json(list(row) if compact else dict(zip(columns, row)))
+
+    if compact:
+        yield b'{"columns":' + encode_json(columns) + b',"rows":['
+    else:
+        yield b"["
+
+    first = True
+    for partition in db.execute(stmt).partitions():
+        chunk = []
+        for row in partition:
+            if skip_keys and (row[key_idx[0]], row[key_idx[1]]) in skip_keys:
+                continue
+            chunk.append(encode(row))
+        if chunk:
+            yield (b"" if first else b",") + b",".join(chunk)
+            first = False
+    for row in extra_rows:
+        yield (b"" if first else b",") + encode(row)
+        first = False
+
+    yield b"]}" if compact else b"]"
+
+def _stream_section(name: str, fn):
+    """Secciones pequeñas: se construyen enteras; un error se emite como {"error": ...} como en generate_json."""
+    try:
+        value = fn()
+    except Exception as e:
+        value = {"error": str(e)}
+    return b'"' + name.encode("utf-8") + b'":' + encode_json(value)
+
+def stream_json(compact: bool = False):
+    """
+    Igual que generate_json, pero generando el JSON por trozos:
+    las colecciones grandes (start_list, results, medallists, meta.units/participants)
+    salen de cursores de servidor con yield_per, así que los primeros bytes se envían
+    antes de leer la última fila y la memoria por petición no crece con la BBDD.
+    Las secciones de widgets salen de app.widget_payloads (read model en memoria), como en
+    /all-data sin stream; con READ_MODEL_ENABLED=false no existen y van vacías, como en generate_json.
+    Abre su propia sesión de lectura, que vive lo que dure la respuesta.
+    """
+    # Importación diferida: widget_payloads depende (vía read_model) de este módulo
+    from .read_model import READ_MODEL_ENABLED
+    from .widget_payloads import payloads as widget_payloads
+
+    db = database.ReadSessionLocal()
+    try:
+        sections = _empty_sections()
+
+        def _widget(key):
+            if READ_MODEL_ENABLED:
+                return lambda: widget_payloads.build_section(key)
+            return lambda: sections.get(key, {})
+
+        first_keys = ("countdown", "champ_title")
+        yield b"{" + b",".join(b'"' + k.encode("utf-8") + b'":' + encode_json(sections[k]) for k in first_keys)
+        yield b"," + _stream_section("timetable", lambda: query_timetable(db))
+        for key in ("event_id", "lane_id", "team_id", "start_list_ind", "start_list_team", "winner_id"):
+            yield b"," + _stream_section(key, _widget(key))
+
+        def _new_record():
+            record_index.ensure_loaded(db)
+            return record_index.new_record_section()
+        yield b"," + _stream_section("new_record", _new_record)
+
+        # results: los LIVE no promocionados (pocos, tabla UNLOGGED) se leen primero
+        live_rows = {
+            (r.unit_id, r.participant_id): r
+            for r in db.execute(select(*[models.LiveResult.__table__.c[c.name] for c in models.Result.__table__.columns])).all()
+        }
+        yield b',"results":'
+        yield from _stream_rows(
+            db, models.Result, compact,
+            skip_keys=set(live_rows), extra_rows=live_rows.values(), fill_splits=query_live_splits(db),
+        )
+
+        if READ_MODEL_ENABLED:
+            yield b"," + _stream_section("results_widget", _widget("results_widget"))
+        yield b"," + _stream_section("qualifiers", _widget("qualifiers"))
+        yield b"," + _stream_section("phase_summary", _widget("phase_summary"))
+        for key in ("ceremony_id", "presenters", "medal_id"):
+            yield b"," + _stream_section(key, lambda: sections[key])
+        yield b"," + _stream_section("medal_list", _widget("medal_list"))
+        yield b"," + _stream_section("medal_tally", lambda: query_medal_tally(db))
+        yield b"," + _stream_section("raising_flags", _widget("raising_flags"))
+
+        yield b',"meta":{"events":'
+        yield from _stream_rows(db, models.Event, False)
+        yield b',"units":'
+        yield from _stream_rows(db, models.Schedule, False)
+        yield b',"participants":'
+        yield from _stream_rows(db, models.Participant, compact)
+        yield b"}"
+
+        yield b"," + _stream_section(
+            "tournament_info", lambda: model_to_dict(db.query(models.TournamentInfo).first())
+        )
+        yield b',"start_list":'
+        yield from _stream_rows(db, models.StartListEntry, False)
+        yield b',"medallists":'
+        yield from _stream_rows(db, models.Medallist, False)
+        yield b"}"
+    except Exception as e:
+        # Con la respuesta ya empezada no se puede cambiar el status: se registra y se corta.
+        log.error(f"Error durante el streaming de /all-data: {e}", exc_info=True)
+        raise
+    finally:
+        db.close()
@@ -1,7 +1,15 @@
 import logging
-from fastapi import FastAPI, Request, Response, status, Depends, WebSocket
+from fastapi import FastAPI, Request, Response, status, Depends, WebSocket, WebSocketDisconnect
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from . import processing, models, database, schemas, json_generator, websockets # Importamos los nuevos módulos
+from . import processing, models, database, schemas, json_generator, websockets, changes # Importamos los nuevos módulos
+from . import read_model, snapshot_cache, compression, deltas, ws_protocol, notify, shared_snapshot, file_exporter
+from .on_air import focus as on_air
+from .prewarm import prewarmer
+from .reference_bundles import bundles as reference_bundles, IMMUTABLE_CACHE_CONTROL
+from .widget_payloads import payloads as widget_payloads
+from .record_index import index as record_index
 
 # --- Configuración del Logging ---
 logging.basicConfig(level=logging.INFO,
@@ -11,6 +19,9 @@ logger = logging.getLogger(__name__)
 # ---------------------------------
 
 app = FastAPI()
+# gzip para el resto de endpoints de lectura (incluido /all-data?stream=true).
+# /all-data desde caché ya sale precomprimido (Content-Encoding puesto) y el middleware no lo toca.
+app.add_middleware(GZipMiddleware, minimum_size=compression.COMPRESSION_MIN_SIZE)
 
 @app.on_event("startup")
 def startup_event():
@@ -24,12 +35,50 @@ def startup_event():
         models.Base.metadata.create_all(bind=database.engine)
         # Si la línea anterior no falla, la conexión fue exitosa.
         logger.info("¡Conexión con la base de datos establecida y tablas verificadas con éxito!")
+        # Columnas, constraints e índices nuevos en tablas que ya existían
+        database.upgrade_schema()
+        db = database.SessionLocal()
+        try:
+            record_index.ensure_loaded(db)
+        finally:
+            db.close()
+        if shared_snapshot.SHARED_SNAPSHOT:
+            shared_snapshot.shared.start()
+        db = database.SessionLocal()
+        try:
+            # Unidad en antena guardada (la fijó el operador en este o en otro worker)
+            on_air.load(db)
+        finally:
+            db.close()
+        if read_model.READ_MODEL_ENABLED and not (shared_snapshot.SHARED_SNAPSHOT and not shared_snapshot.shared.is_writer):
+            # Los workers lectores con snapshot compartido lo cargan solo si algo lo necesita
+            read_model.model.ensure_loaded()
+        if not shared_snapshot.SHARED_SNAPSHOT or shared_snapshot.shared.is_writer:
+            # Con varios workers, los ficheros para playout los escribe solo uno
+            file_exporter.exporter.start()
+        # Unidades próximas según el schedule: cachés calientes antes de la primera petición
+        prewarmer.start()
+        # Commits de otros workers (LISTEN/NOTIFY): read model, cachés y websockets de este proceso.
+        # En un lector del snapshot compartido solo lo que tenga cargado (récords, read model si se usó)
+        notify.start_listener()
     except Exception as e:
         logger.error(f"Error al conectar o verificar las tablas de la BBDD: {e}")
         # Opcional: podrías querer que la app no inicie si no hay BBDD.
         # import sys
         # sys.exit(1)
 
+@shared_snapshot.shared.on_promote
+def take_over_publishing():
+    """ Un worker lector que pasa a escritor (el anterior murió): lo que hacía aquel. """
+    if read_model.READ_MODEL_ENABLED:
+        read_model.model.ensure_loaded()
+    file_exporter.exporter.start()
+
+@app.on_event("startup")
+async def start_websocket_publisher():
+    """ Tarea que envía por /ws los deltas publicados tras cada commit. """
+    await websockets.manager.start()
+
 @app.get("/")
 def read_root():
     """ Endpoint 'Hola Mundo' """
@@ -64,7 +113,7 @@ async def ingest_odf(
         processing.parse_odf_message(xml_string, db) # <-- ¡Parámetro 'db' añadido!
         # --------------------------
 
-        await websockets.manager.broadcast("data updated")
+        # Los clientes reciben el delta versionado de lo confirmado (app.deltas, tras el commit)
         return {"status": "success", "message": "ODF received and sent to parser."}
 
     except Exception as e:
@@ -80,28 +129,242 @@ def create_tournament_info(
 ):
     db_tournament_info = models.TournamentInfo(**tournament_info.dict())
     db.add(db_tournament_info)
+    changes.track(db, 'reload', table='tournament_info')
     db.commit()
     db.refresh(db_tournament_info)
     return db_tournament_info
 
 @app.get("/tournament-info", response_model=schemas.TournamentInfo)
-def get_tournament_info(db: Session = Depends(database.get_db_session)):
+def get_tournament_info(db: Session = Depends(database.get_read_db_session)):
     return db.query(models.TournamentInfo).first()
 
+def _delta_headers(boot: str, version: int) -> dict:
+    return {"X-Delta-Boot": boot, "X-Delta-Version": str(version)}
+
 @app.get("/all-data")
-def get_all_data(db: Session = Depends(database.get_db_session)):
-    return json_generator.generate_json(db)
+def get_all_data(
+    request: Request,
+    response: Response,
+    compact: bool = False,
+    stream: bool = False,
+    bundles: bool = False,
+    sections: str = None,
+    db: Session = Depends(database.get_read_db_session)
+):
+    """
+    Snapshot completo. compact=true: 'results' y 'meta.participants' en formato columnar
+    ({"columns": [...], "rows": [[...], ...]}).
+    stream=true: JSON generado por trozos desde cursores de servidor (memoria acotada).
+    bundles=true: 'meta' solo lleva {"bundles": {nombre: {"hash", "url"}}}; las tablas se
+    descargan aparte desde /bundles/{nombre}/{hash}.
+    sections=a,b,...: solo esas secciones (lo que un delta pide volver a cargar).
+    Cabeceras X-Delta-Boot / X-Delta-Version: el último delta ya incluido en el body (leído
+    antes de renderizarlo). Un cliente de /changes empieza a preguntar con since=X-Delta-Version.
+    """
+    # Antes de renderizar: el body es al menos así de nuevo
+    delta_headers = _delta_headers(deltas.delta_log.boot_id, deltas.delta_log.version)
+    if sections:
+        names = [name for name in sections.split(",") if name in read_model.SECTIONS]
+        if read_model.READ_MODEL_ENABLED:
+            shared = shared_snapshot.shared.read_sections(names, compact) if shared_snapshot.shared.is_reader else None
+            if shared is not None:
+                body, delta_headers = shared[0], _delta_headers(shared[1], shared[2])
+            else:
+                body, _ = snapshot_cache.cache.render(names, compact=compact)
+            return Response(content=body, media_type="application/json", headers=delta_headers)
+        data = json_generator.generate_json(db, compact=compact)
+        response.headers.update(delta_headers)
+        # Sin read model no existen las secciones de widgets: solo las que genera json_generator
+        return {name: data[name] for name in names if name in data}
+    if stream:
+        return StreamingResponse(json_generator.stream_json(compact=compact), media_type="application/json",
+                                 headers=delta_headers)
+    if read_model.READ_MODEL_ENABLED:
+        # Secciones pre-serializadas y versionadas (y precomprimidas): si el cliente ya está al día, 304.
+        encoding = compression.negotiate(request.headers.get("accept-encoding"))
+        shared = shared_snapshot.shared.read(compact, bundles, encoding) if shared_snapshot.SHARED_SNAPSHOT else None
+        if shared is not None:
+            # Publicado por el worker escritor: se sirve directamente desde el mmap, sin copia
+            body, etag, encoding, boot, version = shared
+            delta_headers = _delta_headers(boot, version)
+        else:
+            body, etag, encoding = snapshot_cache.cache.render_encoded(compact=compact, encoding=encoding, bundles=bundles)
+        headers = {"ETag": etag, "Vary": "Accept-Encoding", **delta_headers}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+    data = json_generator.generate_json(db, compact=compact)
+    if bundles:
+        data["meta"] = {"bundles": reference_bundles.refs()}
+    response.headers.update(delta_headers)
+    return data
+
+@app.get("/changes")
+async def get_changes(since: int = None, boot: str = None, wait: float = 0):
+    """
+    Para clientes que solo pueden hacer polling HTTP: los deltas posteriores a 'since' (los
+    mismos mensajes que /ws), como {"type": "changes", "boot", "version", "deltas": [...]}.
+    wait=N: long-polling; si no hay nada nuevo, espera hasta N segundos al siguiente cambio.
+    Si 'since' ya no está en el registro (o 'boot' es de otro arranque) se responde
+    resync_required: hay que volver a cargar /all-data.
+    El 'since' inicial es el X-Delta-Version (y 'boot' el X-Delta-Boot) del /all-data que se
+    cargó: así no se pierde ningún delta entre la carga y la primera pregunta.
+    Sin 'since': solo la versión actual (no sirve para enlazar con un /all-data ya cargado).
+    """
+    log = deltas.delta_log
+    if since is None:
+        return Response(content=log.hello(), media_type="application/json")
+    if wait > 0 and since == log.version and boot in (None, log.boot_id):
+        await log.wait(since, min(wait, deltas.CHANGES_MAX_WAIT))
+    return Response(content=log.changes(since, boot), media_type="application/json",
+                    headers={"Cache-Control": "no-store"})
+
+# --- Bundles de referencia (participantes, NOCs, pruebas, unidades) ---
+
+@app.get("/bundles")
+def get_bundles():
+    """ Hashes y URLs vigentes de los bundles de referencia. """
+    refs = shared_snapshot.shared.bundle_refs() if shared_snapshot.shared.is_reader else None
+    return Response(content=json_generator.encode_json(refs if refs is not None else reference_bundles.refs()),
+                    media_type="application/json",
+                    headers={"Cache-Control": "no-cache"})
+
+@app.get("/bundles/{name}/{digest}")
+def get_bundle(name: str, digest: str, request: Request):
+    """ Contenido de un bundle. La URL incluye el hash: la respuesta es inmutable. """
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": f'"{digest}"', "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == f'"{digest}"':
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    encoding = compression.negotiate(request.headers.get("accept-encoding"))
+    body = None
+    if shared_snapshot.shared.is_reader:
+        body, used = shared_snapshot.shared.read_bundle(name, digest, encoding) # Ficheros del escritor
+    if body is None:
+        body, used = reference_bundles.get(name, digest, encoding)
+    encoding = used
+    if body is None:
+        return _not_found("Bundle not found")
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# --- Endpoints de lectura acotados (un widget no necesita todo /all-data) ---
+
+def _not_found(message: str):
+    return Response(content=f'{{"error": "{message}"}}',
+                    media_type="application/json",
+                    status_code=status.HTTP_404_NOT_FOUND)
+
+@app.get("/units/{unit_id}")
+def get_unit(unit_id: str, db: Session = Depends(database.get_read_db_session)):
+    """ Start list, resultados y participantes de una unidad. """
+    data = json_generator.query_unit(db, unit_id)
+    return data if data is not None else _not_found("Unit not found")
+
+@app.get("/events/{event_id}")
+def get_event(event_id: str, db: Session = Depends(database.get_read_db_session)):
+    """ Unidades y medallistas de una prueba. """
+    data = json_generator.query_event(db, event_id)
+    return data if data is not None else _not_found("Event not found")
 
+@app.get("/participants/{participant_id}")
+def get_participant(participant_id: str, db: Session = Depends(database.get_read_db_session)):
+    """ Entradas, resultados y medallas de un participante. """
+    data = json_generator.query_participant(db, participant_id)
+    return data if data is not None else _not_found("Participant not found")
+
+@app.get("/schedule/now-next")
+def get_schedule_now_next(
+    past_minutes: int = 30,
+    next_count: int = 3,
+    db: Session = Depends(database.get_read_db_session)
+):
+    """ Ventana now/next del schedule. """
+    return json_generator.query_schedule_window(db, past_minutes=past_minutes, next_count=next_count)
+
+@app.get("/widgets/units/{unit_id}")
+def get_unit_widgets(unit_id: str):
+    """ Payloads de widgets de una unidad, ya unidos y cacheados (read model). """
+    if read_model.model.get("schedule", unit_id) is None:
+        return _not_found("Unit not found")
+    return widget_payloads.unit(unit_id)
+
+@app.get("/widgets/events/{event_id}")
+def get_event_widgets(event_id: str):
+    """ Payloads de widgets de una prueba (phase summary, medallistas, banderas). """
+    if read_model.model.get("events", event_id) is None:
+        return _not_found("Event not found")
+    return widget_payloads.event(event_id)
+
+@app.get("/splits")
+def get_splits(
+    event_id: str = None,
+    unit_id: str = None,
+    position: int = None,
+    db: Session = Depends(database.get_read_db_session)
+):
+    """ Parciales normalizados, filtrables por prueba, unidad y posición (metros). """
+    return json_generator.query_splits(db, event_id=event_id, unit_id=unit_id, position=position)
+
+# --- Unidad en antena (current / next) ---
+
+@app.get("/on-air")
+def get_on_air():
+    """ Unidad en antena, siguientes y sus paquetes completos (desde memoria). """
+    return Response(content=on_air.response(), media_type="application/json")
+
+@app.put("/on-air")
+def set_on_air(update: schemas.OnAirUpdate, db: Session = Depends(database.get_read_db_session)):
+    """
+    El operador fija la unidad en antena y las siguientes: se guarda en BBDD y todos los
+    workers lo aplican (sus paquetes se precargan).
+    """
+    for unit_id in ([update.current] if update.current else []) + update.next:
+        if shared_snapshot.shared.is_reader:
+            exists = db.get(models.Schedule, unit_id) is not None # Sin cargar el read model
+        else:
+            exists = read_model.model.get("schedule", unit_id) is not None
+        if not exists:
+            return _not_found(f"Unit not found: {unit_id}")
+    on_air.set(update.current, update.next)
+    return Response(content=on_air.response(wait=True), media_type="application/json")
+
+@app.get("/on-air/units/{unit_id}")
+def get_on_air_package(unit_id: str):
+    """ Paquete de una unidad: start list, widgets, récords, rondas previas y banderas. """
+    body = on_air.package(unit_id)
+    if body is None:
+        return _not_found("Unit not found")
+    return Response(content=body, media_type="application/json")
+
+# permessage-deflate en /ws lo negocia uvicorn (--ws-per-message-deflate, ver start_all.bat).
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websockets.manager.connect(websocket)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    snapshot: bool = True,
+    compact: bool = False,
+    bundles: bool = False,
+    encoding: str = "json"
+):
+    """
+    Protocolo tipado (ver app/ws_protocol.py). Al conectar se envía el snapshot inicial
+    desde la caché del read model (snapshot=false: solo la versión actual).
+    encoding=msgpack: frames binarios MessagePack (si el paquete está instalado); JSON por defecto.
+    """
+    await websockets.manager.connect(websocket, binary=(encoding == "msgpack"))
     try:
+        await ws_protocol.open_session(websocket, snapshot, compact, bundles)
         while True:
-            data = await websocket.receive_text()
-            # For now, we're just broadcasting the data back to the client.
-            # In a real application, you might want to do something more with the data.
-            await websockets.manager.broadcast(f"Message text was: {data}")
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                break
+            data = received.get("text")
+            await ws_protocol.handle_message(websocket, data if data is not None else received.get("bytes"))
+    except WebSocketDisconnect:
+        pass # Cierre normal del cliente
     except Exception as e:
-        pass
+        logger.error(f"Error en la conexión websocket: {e}", exc_info=True)
     finally:
-        websockets.manager.disconnect(websocket)
\ No newline at end of file
+        websockets.manager.disconnect(websocket)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey, TIMESTAMP, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey, TIMESTAMP, UniqueConstraint, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from .database import Base
 
@@ -35,11 +35,11 @@ class Schedule(Base):
     __tablename__ = 'schedule'
     
     unit_id = Column(String(50), primary_key=True)
-    event_id = Column(String(50), ForeignKey('events.event_id'))
+    event_id = Column(String(50), ForeignKey('events.event_id'), index=True)
     name = Column(String(100), nullable=True) # Ej: "Men's 400m Freestyle S8 Heat 1"
     phase = Column(String(50))
     unit_num = Column(Integer)
-    start_time = Column(TIMESTAMP(timezone=True)) 
+    start_time = Column(TIMESTAMP(timezone=True), index=True) 
     status = Column(String(20), default='SCHEDULED')
     config_data = Column(JSONB)
 
@@ -50,10 +50,16 @@ class Record(Base):
     event_id = Column(String(50), ForeignKey('events.event_id'))
     record_type = Column(String(10), nullable=False)
     time = Column(String(20), nullable=False)
+    time_hs = Column(Integer, nullable=True) # Tiempo en centésimas (para comparar sin parsear strings)
     holder_name = Column(String(255))
     holder_noc = Column(String(3), ForeignKey('nocs.noc'))
     year = Column(Integer)
 
+    __table_args__ = (
+        # Usada por el ON CONFLICT de parser_records; también sirve de índice (event_id, record_type)
+        UniqueConstraint('event_id', 'record_type', name='uq_record'),
+    )
+
 class MedalTally(Base):
     __tablename__ = 'medaltally'
 
@@ -99,7 +105,9 @@ class StartListEntry(Base):
         # Solo un competidor por calle en esta serie
         UniqueConstraint('unit_id', 'lane', name='_unit_lane_uc'), 
         # Solo una entrada por competidor en esta serie
-        UniqueConstraint('unit_id', 'participant_id', name='_unit_participant_uc') 
+        UniqueConstraint('unit_id', 'participant_id', name='_unit_participant_uc'),
+        # Endpoints por participante
+        Index('ix_start_list_participant', 'participant_id'),
     )
 
 class Result(Base):
@@ -112,6 +120,8 @@ class Result(Base):
     rank = Column(Integer, nullable=True)
     time = Column(String(20), nullable=True)
     diff = Column(String(20), nullable=True) # <-- Asegúrate de tener esta también
+    time_hs = Column(Integer, nullable=True) # 'time' en centésimas
+    diff_hs = Column(Integer, nullable=True) # 'diff' en centésimas (con signo)
     reaction_time = Column(Float, nullable=True)
     splits = Column(JSONB, nullable=True)
     qualification_mark = Column(String(10), nullable=True) 
@@ -124,6 +134,65 @@ class Result(Base):
     # Tu restricción única
     __table_args__ = (
         UniqueConstraint('unit_id', 'participant_id', name='_unit_participant_result_uc'),
+        Index('ix_results_unit_time', 'unit_id', 'time_hs'),
+        Index('ix_results_participant', 'participant_id'),
+    )
+
+class LiveResult(Base):
+    """
+    Estado LIVE transitorio de 'results' (modo LIVE_RESULTS_UNLOGGED).
+    Tabla UNLOGGED: no genera WAL y se vacía tras un crash, lo cual es aceptable
+    porque el UNOFFICIAL/OFFICIAL posterior la sustituye en 'results'.
+    """
+    __tablename__ = 'live_results'
+
+    result_id = Column(Integer, primary_key=True, autoincrement=True)
+    unit_id = Column(String(50), ForeignKey('schedule.unit_id'), nullable=False)
+    participant_id = Column(String(50), ForeignKey('participants.participant_id'), nullable=False)
+
+    rank = Column(Integer, nullable=True)
+    time = Column(String(20), nullable=True)
+    diff = Column(String(20), nullable=True)
+    time_hs = Column(Integer, nullable=True)
+    diff_hs = Column(Integer, nullable=True)
+    reaction_time = Column(Float, nullable=True)
+    splits = Column(JSONB, nullable=True)
+    qualification_mark = Column(String(10), nullable=True)
+    irm = Column(String(10), nullable=True)
+    record_mark = Column(String(10), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('unit_id', 'participant_id', name='_unit_participant_live_result_uc'),
+        Index('ix_live_results_unit_time', 'unit_id', 'time_hs'),
+        {'prefixes': ['UNLOGGED']},
+    )
+
+class Split(Base):
+    """
+    Parciales normalizados (append-only). Una fila por posición de paso:
+    - Split de equipo/individual: athlete_id = '' (cadena vacía, para que la clave única funcione).
+    - Split de un relevista: athlete_id = código del atleta.
+    """
+    __tablename__ = 'splits'
+
+    split_id = Column(Integer, primary_key=True, autoincrement=True)
+    unit_id = Column(String(50), ForeignKey('schedule.unit_id'), nullable=False)
+    event_id = Column(String(50), nullable=True) # Derivado del UnitID, para consultas por prueba
+    participant_id = Column(String(50), ForeignKey('participants.participant_id'), nullable=False)
+    athlete_id = Column(String(50), nullable=False, default='')
+
+    position = Column(Integer, nullable=False) # Metros del paso (ExtendedResult @Pos)
+    value = Column(String(20), nullable=True)
+    value_hs = Column(Integer, nullable=True) # 'value' en centésimas
+    rank = Column(Integer, nullable=True)
+    diff = Column(String(20), nullable=True)
+    value2 = Column(String(20), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('unit_id', 'participant_id', 'athlete_id', 'position', name='_unit_participant_athlete_split_uc'),
+        # Ej: "todos los parciales de 50 m de esta prueba"
+        Index('ix_splits_event_position', 'event_id', 'position'),
+        Index('ix_splits_unit_position', 'unit_id', 'position'),
     )
 
 class Medallist(Base):
@@ -147,6 +216,7 @@ class Medallist(Base):
     # Aseguramos que solo haya una medalla por participante por evento
     __table_args__ = (
         UniqueConstraint('event_id', 'participant_id', name='_event_participant_medal_uc'),
+        Index('ix_medallists_participant', 'participant_id'),
         # Podríamos añadir también ('event_id', 'medal_type') si queremos asegurar solo un oro, etc.
     )
 
@@ -157,4 +227,12 @@ class TournamentInfo(Base):
     name = Column(String(255), nullable=False)
     logo_path_local = Column(Text)
     logo_url_cloud = Column(Text)
-    website_url = Column(Text)
\ No newline at end of file
+    website_url = Column(Text)
+class OnAirState(Base):
+    """ Unidad en antena y siguientes (una sola fila, id=1): compartida por todos los workers. """
+    __tablename__ = 'on_air'
+
+    id = Column(Integer, primary_key=True)
+    current_unit_id = Column(String(50), nullable=True)
+    # Lista ordenada de unit_id siguientes
+    next_unit_ids = Column(JSONB, nullable=False, default=list)
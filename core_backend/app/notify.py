@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from typing import Optional
+
+from sqlalchemy import event, select as sql_select, text, tuple_
+
+from . import changes, database, models
+from .json_generator import encode_json
+from .read_model import TABLE_KEYS, TABLE_MODELS, model as read_model
+from .shared_snapshot import shared
+from .snapshot_cache import sections_for_change
+
+log = logging.getLogger(__name__)
+
+# Con varios workers de uvicorn, cada commit se anuncia con NOTIFY y el resto de procesos
+# actualizan su read model / cachés y avisan a sus propios websockets.
+CROSS_WORKER_NOTIFY = os.getenv("CROSS_WORKER_NOTIFY", "true").lower() in ("1", "true", "yes")
+NOTIFY_CHANNEL = os.getenv("NOTIFY_CHANNEL", "odf_changes")
+# Límite de Postgres: 8000 bytes por payload. Por encima se anuncia una recarga de tablas.
+NOTIFY_MAX_PAYLOAD = 7900
+NOTIFY_RECONNECT_SECONDS = 5
+
+# Identifica a este proceso: sus propias notificaciones se ignoran al recibirlas.
+ORIGIN_ID = uuid.uuid4().hex
+
+# Tablas cuyas filas se anuncian por clave (el receptor las relee de BBDD).
+NOTIFY_KEYS = {**TABLE_KEYS, "records": ("event_id", "record_type")}
+NOTIFY_MODELS = {**TABLE_MODELS, "records": models.Record}
+
+
+def build_payload(batch: list) -> Optional[str]:
+    """
+    Resumen de un lote para otros workers: unidades y secciones afectadas, claves de las
+    filas escritas, borrados, recargas, detecciones de récord y unidad en antena. Las filas no viajan.
+    """
+    rows, deletes, reloads = {}, [], set()
+    units, sections, record_breaks = set(), set(), {}
+    on_air = None
+    for change in batch:
+        sections |= sections_for_change(change)
+        kind, table = change["kind"], change.get("table")
+        if kind == "records":
+            table = "records"
+        if kind in ("rows", "records") and table in NOTIFY_KEYS:
+            keys = NOTIFY_KEYS[table]
+            for row in change["rows"]:
+                rows.setdefault(table, set()).add(tuple(row.get(k) for k in keys))
+                if row.get("unit_id"):
+                    units.add(row["unit_id"])
+        elif kind == "delete" and table in NOTIFY_KEYS:
+            deletes.append([table, change["match"]])
+            if change["match"].get("unit_id"):
+                units.add(change["match"]["unit_id"])
+        elif kind == "reload" and table in NOTIFY_KEYS:
+            reloads.add(table)
+        elif kind == "record_breaks":
+            record_breaks[change["unit_id"]] = change["detections"]
+            units.add(change["unit_id"])
+        elif kind == "on_air":
+            on_air = {"current": change["current"], "next": change["next"]}
+    if not (rows or deletes or reloads or record_breaks or on_air):
+        return None
+
+    payload = {
+        "origin": ORIGIN_ID,
+        "units": sorted(units),
+        "sections": sorted(sections),
+        "rows": {table: [list(key) for key in keys] for table, keys in rows.items()},
+        "deletes": deletes,
+        "reloads": sorted(reloads),
+        "record_breaks": record_breaks,
+        "on_air": on_air,
+    }
+    encoded = encode_json(payload)
+    if len(encoded) > NOTIFY_MAX_PAYLOAD:
+        # Demasiadas filas para un NOTIFY: que los demás recarguen esas tablas completas
+        payload.update(rows={}, record_breaks={}, reloads=sorted(reloads | set(rows)))
+        encoded = encode_json(payload)
+    return encoded.decode("utf-8")
+
+
+def remote_batch(payload: dict, reread_rows: bool = True) -> list:
+    """
+    Reconstruye, releyendo de BBDD, el lote que otro worker confirmó.
+    reread_rows=False: solo se releen los récords (índice de récords); el resto de filas
+    solo las necesita un read model cargado.
+    """
+    batch = [{"kind": "delete", "table": table, "match": match} for table, match in payload.get("deletes", [])]
+    db = database.SessionLocal() # Primario: lo que se acaba de confirmar
+    try:
+        for table, keys in payload.get("rows", {}).items():
+            if not reread_rows and table != "records":
+                continue
+            model = NOTIFY_MODELS[table]
+            columns = [model.__table__.c[name] for name in NOTIFY_KEYS[table]]
+            if len(columns) == 1:
+                condition = columns[0].in_([key[0] for key in keys])
+            else:
+                condition = tuple_(*columns).in_([tuple(key) for key in keys])
+            rows = [dict(r._mapping) for r in db.execute(sql_select(*model.__table__.columns).where(condition))]
+            if table == "records":
+                batch.append({"kind": "records", "rows": rows})
+            elif rows:
+                batch.append({"kind": "rows", "table": table, "rows": rows})
+        for table in payload.get("reloads", []):
+            if table == "records":
+                rows = [dict(r._mapping) for r in db.execute(sql_select(*models.Record.__table__.columns))]
+                batch.append({"kind": "records", "rows": rows})
+            else:
+                batch.append({"kind": "reload", "table": table})
+    finally:
+        db.close()
+    for unit_id, detections in payload.get("record_breaks", {}).items():
+        batch.append({"kind": "record_breaks", "unit_id": unit_id, "detections": detections})
+    if payload.get("on_air"):
+        batch.append({"kind": "on_air", **payload["on_air"]})
+    return batch
+
+
+@event.listens_for(database.SessionLocal, "before_commit")
+def _notify_before_commit(session):
+    # Dentro de la transacción: Postgres solo entrega el NOTIFY si el commit se confirma
+    if not CROSS_WORKER_NOTIFY or session.get_bind().dialect.name != "postgresql":
+        return
+    batch = changes.pending(session)
+    if not batch:
+        return
+    payload = build_payload(batch)
+    if payload is not None:
+        session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": payload})
+
+
+class NotificationListener(threading.Thread):
+    """Hilo por worker con una conexión dedicada en LISTEN. Reconecta si se pierde."""
+
+    def __init__(self):
+        super().__init__(name="odf-notify-listener", daemon=True)
+        self._connected_before = False
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                log.error(f"Conexión LISTEN perdida ({e}); reintentando en {NOTIFY_RECONNECT_SECONDS}s")
+                time.sleep(NOTIFY_RECONNECT_SECONDS)
+
+    def _listen(self):
+        raw = database.engine.raw_connection()
+        raw.detach() # Conexión propia, fuera del pool
+        conn = raw.driver_connection
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            cursor.close()
+            if self._connected_before:
+                # Mientras no escuchábamos se han podido perder notificaciones: recarga completa
+                changes.dispatch([{"kind": "reload", "table": table} for table in TABLE_KEYS])
+            self._connected_before = True
+            log.info(f"Escuchando notificaciones de otros workers en '{NOTIFY_CHANNEL}'")
+            if callable(getattr(conn, "notifies", None)):
+                # psycopg 3
+                for notification in conn.notifies():
+                    self._handle(notification.payload)
+            else:
+                # psycopg2
+                while True:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle(conn.notifies.pop(0).payload)
+        finally:
+            raw.close()
+
+    def _handle(self, raw_payload: str):
+        try:
+            payload = json.loads(raw_payload)
+            if payload.get("origin") == ORIGIN_ID:
+                return # Commit propio: ya se aplicó en after_commit
+            # Un lector del snapshot compartido sin read model no relee filas: no multiplica la carga de BBDD
+            changes.dispatch(remote_batch(payload, reread_rows=not shared.is_reader or read_model.active))
+        except Exception as e:
+            log.error(f"Error aplicando notificación de otro worker: {e}", exc_info=True)
+
+
+_listener: Optional[NotificationListener] = None
+
+
+def start_listener():
+    global _listener
+    if not CROSS_WORKER_NOTIFY or _listener is not None:
+        return
+    if database.engine.dialect.name != "postgresql":
+        log.warning("LISTEN/NOTIFY entre workers requiere PostgreSQL: desactivado")
+        return
+    _listener = NotificationListener()
+    _listener.start()
@@ -0,0 +1,248 @@
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from . import changes, database, models
+from .json_generator import encode_json
+from .read_model import model as read_model
+from .record_index import index as record_index
+from .shared_snapshot import broadcast, shared
+from .websockets import manager
+from .widget_payloads import affected_units_and_events, payloads as widget_payloads
+
+log = logging.getLogger(__name__)
+
+# Topic de /ws con el estado en antena y los paquetes de sus unidades.
+ON_AIR_TOPIC = "on_air"
+# PUT /on-air en un worker lector: espera máxima (s) a que el escritor publique los paquetes nuevos.
+SHARED_RESPONSE_WAIT = 2
+
+
+def _start_key(unit: dict):
+    return (unit.get("start_time") is None, unit.get("start_time") or 0)
+
+
+def build_package(unit_id: str) -> Optional[dict]:
+    """
+    Todo lo que necesitan los grafismos de una unidad: start list (con composiciones),
+    payloads de widgets, récords de la prueba, resultados de las rondas anteriores y banderas.
+    """
+    unit = read_model.get("schedule", unit_id)
+    if unit is None:
+        return None
+    event_id = unit.get("event_id")
+    start_list = sorted(
+        read_model.unit_rows("start_list_entries", unit_id),
+        key=lambda s: (s.get("lane") is None, s.get("lane") or 0),
+    )
+    widgets = widget_payloads.unit(unit_id)
+
+    # Rondas anteriores de la misma prueba (series antes de la final...)
+    previous_rounds = []
+    if event_id:
+        for other in sorted(read_model.rows("schedule"), key=_start_key):
+            if other.get("event_id") != event_id or other["unit_id"] == unit_id:
+                continue
+            if _start_key(other) >= _start_key(unit):
+                continue
+            previous_rounds.append({
+                "unit_id": other["unit_id"],
+                "unit_name": other.get("name"),
+                "phase": other.get("phase"),
+                "status": other.get("status"),
+                "results": widget_payloads.unit(other["unit_id"])["results_widget"],
+            })
+
+    nocs = {}
+    for entry in widgets["lane_id"] + widgets["results_widget"]:
+        if entry.get("noc"):
+            nocs[entry["noc"]] = {"noc_name": entry.get("noc_name"), "flag": entry.get("flag")}
+
+    return {
+        "unit": unit,
+        "event": read_model.get("events", event_id) if event_id else None,
+        "start_list": start_list,
+        "widgets": widgets,
+        "records": record_index.records_for_event(event_id) if event_id else {},
+        "previous_rounds": previous_rounds,
+        "nocs": nocs,
+    }
+
+
+class OnAir:
+    """
+    Unidad en antena (current) y siguientes (next), fijadas por el operador.
+
+    - El estado se guarda en BBDD (tabla 'on_air'): el commit lo aplica en este worker y,
+      vía NOTIFY, en el resto; un worker que arranca lo lee de ahí.
+    - Sus paquetes (build_package) se construyen al fijarlas y se mantienen ya serializados:
+      los grafismos de la unidad en antena se sirven siempre desde memoria.
+    - Cada commit que les afecta reconstruye el paquete en el momento y lo publica en el
+      topic 'on_air', sin esperar a la ventana de agrupación de los deltas.
+    - Con snapshot compartido solo el escritor construye los paquetes; los deja en ficheros
+      de los que leen los lectores.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current: Optional[str] = None
+        self.next: List[str] = []
+        self.revision = 0
+        self._packages: Dict[str, bytes] = {}
+        self._shared_units = set() # Paquetes que este worker (escritor) tiene publicados en ficheros
+
+    def units(self) -> List[str]:
+        with self._lock:
+            return ([self.current] if self.current else []) + [u for u in self.next if u != self.current]
+
+    def _events(self, unit_ids) -> set:
+        events = set()
+        for unit_id in unit_ids:
+            unit = read_model.get("schedule", unit_id)
+            if unit and unit.get("event_id"):
+                events.add(unit["event_id"])
+        return events
+
+    # --- Estado ---
+
+    def set(self, current: Optional[str], next_units: List[str]):
+        """Guarda el nuevo estado; se aplica al confirmarse el commit (en todos los workers)."""
+        next_units = list(dict.fromkeys(next_units))
+        db = database.SessionLocal()
+        try:
+            row = db.get(models.OnAirState, 1) or models.OnAirState(id=1)
+            row.current_unit_id = current
+            row.next_unit_ids = next_units
+            db.add(row)
+            changes.track(db, "on_air", current=current, next=next_units)
+            db.commit()
+        finally:
+            db.close()
+
+    def load(self, db):
+        """Estado guardado (al arrancar el worker)."""
+        row = db.get(models.OnAirState, 1)
+        if row is not None and (row.current_unit_id or row.next_unit_ids):
+            self.apply(row.current_unit_id, row.next_unit_ids or [])
+
+    def apply(self, current: Optional[str], next_units: List[str]):
+        with self._lock:
+            self.current = current
+            self.next = list(dict.fromkeys(next_units))
+        log.info(f"En antena: {current} (siguientes: {', '.join(self.next) or '-'})")
+        if not shared.is_reader: # Los paquetes de un lector los construye el escritor
+            self.refresh(self.units(), reset=True)
+
+    def state(self) -> dict:
+        with self._lock:
+            return {"current": self.current, "next": list(self.next), "revision": self.revision}
+
+    # --- Paquetes ---
+
+    def package(self, unit_id: str) -> Optional[bytes]:
+        with self._lock:
+            cached = self._packages.get(unit_id)
+        if cached is None and shared.is_reader and unit_id in self.units():
+            cached = shared.read_blob(f"on_air-{unit_id}")
+        if cached is not None:
+            return cached
+        package = build_package(unit_id) # Unidad fuera de antena: bajo demanda, sin cachear
+        return encode_json(package) if package is not None else None
+
+    def _response(self) -> bytes:
+        state = self.state()
+        packages = b",".join(encode_json(unit_id) + b":" + self.package(unit_id) for unit_id in self.units())
+        return encode_json(state)[:-1] + b',"packages":{' + packages + b"}}"
+
+    def response(self, wait: bool = False) -> bytes:
+        """
+        Estado y paquetes completos (GET/PUT /on-air). En un lector, los que publicó el escritor;
+        wait=True (tras un PUT): espera a que el escritor haya aplicado el estado de este worker.
+        """
+        if not shared.is_reader:
+            return self._response()
+        deadline = time.monotonic() + (SHARED_RESPONSE_WAIT if wait else 0)
+        while True:
+            blob = shared.read_blob("on_air")
+            if blob is not None and not wait:
+                return blob
+            if blob is not None:
+                published = json.loads(blob)
+                with self._lock:
+                    if (published["current"], published["next"]) == (self.current, self.next):
+                        return blob
+            if time.monotonic() >= deadline:
+                return self._response() # Sin escritor al día: se construye aquí
+            time.sleep(0.02)
+
+    def refresh(self, unit_ids: List[str], reset: bool = False):
+        """Reconstruye los paquetes de 'unit_ids' y los publica (reset: sustituye a todos)."""
+        packages = {}
+        for unit_id in unit_ids:
+            package = build_package(unit_id)
+            if package is not None:
+                packages[unit_id] = encode_json(package)
+        with self._lock:
+            focused = set(([self.current] if self.current else []) + self.next)
+            if reset:
+                self._packages = {}
+            for unit_id, blob in packages.items():
+                if unit_id in focused:
+                    self._packages[unit_id] = blob
+            self.revision += 1
+            head = encode_json({
+                "type": "on_air", "current": self.current, "next": list(self.next),
+                "revision": self.revision, "reset": reset,
+            })
+        if shared.is_writer:
+            self._publish_shared(packages, focused)
+        if manager.has_subscribers(ON_AIR_TOPIC):
+            body = b",".join(encode_json(unit_id) + b":" + blob for unit_id, blob in packages.items())
+            broadcast((head[:-1] + b',"packages":{' + body + b"}}").decode("utf-8"), (ON_AIR_TOPIC,))
+
+    def _publish_shared(self, packages: Dict[str, bytes], focused: set):
+        for unit_id, blob in packages.items():
+            if unit_id in focused:
+                shared.write_blob(f"on_air-{unit_id}", blob)
+        for unit_id in self._shared_units - focused:
+            shared.remove_blob(f"on_air-{unit_id}")
+        self._shared_units = set(focused)
+        shared.write_blob("on_air", self._response())
+
+    def touched(self, batch: list) -> List[str]:
+        """Unidades en antena cuyo paquete cambia con este lote (incluidas rondas previas y récords)."""
+        units = self.units()
+        if not units:
+            return []
+        affected = affected_units_and_events(batch)
+        if affected is None:
+            return units
+        unit_events = {unit_id: self._events([unit_id]) for unit_id in units}
+        touched_events = set(affected[1]) | self._events(affected[0])
+        for change in batch:
+            if change["kind"] == "records":
+                touched_events |= {row.get("event_id") for row in change["rows"]}
+        return [u for u in units if u in affected[0] or unit_events[u] & touched_events]
+
+
+focus = OnAir()
+
+
+@changes.on_commit
+def _refresh_on_air_units(batch: list):
+    for change in batch:
+        if change["kind"] == "on_air":
+            focus.apply(change["current"], change["next"])
+    if shared.is_reader:
+        return # Sin read model: el worker escritor reconstruye y publica los paquetes
+    touched = focus.touched(batch)
+    if touched:
+        focus.refresh(touched)
+
+
+@shared.on_promote
+def _publish_on_air_packages():
+    # El lector que pasa a escritor aún no tenía paquetes: se construyen y publican
+    focus.refresh(focus.units(), reset=True)
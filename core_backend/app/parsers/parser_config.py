@@ -2,7 +2,7 @@ import logging
 from lxml import etree
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
-from .. import models
+from .. import models, changes
 from .id_validators import normalize_unit_id
 
 logger = logging.getLogger(__name__)
@@ -84,7 +84,7 @@ def parse(root: etree._Element, db: Session):
                     'config_data': models.Schedule.config_data.op('||')(config_dict)
                 }
             )
-            db.execute(stmt)
+            changes.execute_tracked(db, stmt, models.Schedule)
             processed_count += 1
 
         db.commit()
@@ -2,7 +2,7 @@ import logging
 from lxml import etree
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from .. import models
+from .. import models, changes
 import re
 
 log = logging.getLogger(__name__)
@@ -80,7 +80,7 @@ def parse_dt_codes_event(message: etree._Element, db: Session):
                 # No tocamos distance/stroke, dejamos que schedule los gestione
             }
         )
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, models.Event)
         log.info(f"[parser_events.py] Procesados y actualizados {len(events_data)} Eventos.")
         
     except Exception as e:
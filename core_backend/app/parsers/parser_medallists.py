@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 # Make sure Event is imported here if it wasn't already
 from ..models import Medallist, Event
+from .. import changes
 
 log = logging.getLogger(__name__)
 
@@ -59,7 +60,7 @@ def _ensure_event_exists(db: Session, event_id_normalized: str, message: etree._
     # Si no existe, inserta la fila stub.
     stmt = stmt.on_conflict_do_nothing(index_elements=['event_id'])
 
-    db.execute(stmt)
+    changes.execute_tracked(db, stmt, Event)
     log.debug(f"Ensured event exists: {event_id_normalized} with gender {gender_code}")
 
 # --- El resto del parser_medallists.py no cambia ---
@@ -123,7 +124,7 @@ def parse_dt_medallists(db: Session, message: etree._Element):
                 'final_unit_id': stmt.excluded.final_unit_id
             }
         )
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, Medallist)
 
         db.commit()
         log.info(f"Medallistas (DT_MEDALLISTS) actualizados en tabla 'medallists' para Evento={event_id}")
@@ -5,6 +5,7 @@ from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 # Importamos los modelos y helpers necesarios
 from ..models import Medallist, Event
+from .. import changes
 # Reutilizamos los helpers de parser_medallists
 from .parser_medallists import MEDAL_MAP, _normalize_event_id, _ensure_event_exists
 
@@ -86,7 +87,7 @@ def parse_dt_medallists_discipline(db: Session, message: etree._Element):
                 # No incluimos 'final_unit_id' en el SET
             }
         )
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, Medallist)
 
         db.commit()
         log.info(f"Medallistas (DT_MEDALLISTS_DISCIPLINE) procesados para {discipline_code}. Total: {len(medallists_to_upsert)}.")
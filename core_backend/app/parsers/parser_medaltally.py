@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from ..models import MedalTally
+from .. import changes
 
 log = logging.getLogger(__name__)
 
@@ -69,7 +70,7 @@ def parse_dt_medals(db: Session, message: etree._Element):
                 'total': stmt.excluded.total
             }
         )
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, MedalTally)
         db.commit()
         log.info(f"Medallero (DT_MEDALS) actualizado con {len(tally_data)} NOCs (incl. SortRank).")
 
@@ -2,7 +2,7 @@ import logging
 from lxml import etree
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from .. import models
+from .. import models, changes
 
 log = logging.getLogger(__name__)
 
@@ -70,7 +70,7 @@ def parse_dt_codes_noc(message: etree._Element, db: Session):
                 'short_name': stmt.excluded.short_name
             }
         )
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, models.Noc)
         log.info(f"[parser_nocs.py] Procesados y actualizados {len(nocs_data)} NOCs.")
         
     except Exception as e:
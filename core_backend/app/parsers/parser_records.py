@@ -2,9 +2,10 @@ import logging
 from lxml import etree
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert 
-from .. import models
+from .. import models, changes
 import datetime
 import re 
+from .time_helpers import time_to_hundredths
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +19,7 @@ def _ensure_noc_exists(db: Session, noc: str):
         stmt = pg_insert(models.Noc).values(
             noc=noc, long_name=noc, short_name=noc
         ).on_conflict_do_nothing(index_elements=['noc'])
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, models.Noc)
     except Exception as e:
         logger.error(f"Error al asegurar NOC '{noc}': {e}", exc_info=False)
         pass
@@ -44,7 +45,7 @@ def _ensure_event_exists(db: Session, event_id_normalized: str):
             name=event_id_normalized, 
             gender=gender_code 
         ).on_conflict_do_nothing(index_elements=['event_id'])
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, models.Event)
     except Exception as e:
         logger.error(f"Error al asegurar Evento '{event_id_normalized}': {e}", exc_info=False)
         pass
@@ -136,6 +137,7 @@ def parse(root: etree._Element, db: Session):
                     'event_id': event_id, # ID completo
                     'record_type': record_type,
                     'time': record_time,
+                    'time_hs': time_to_hundredths(record_time),
                     'holder_name': holder_name or None,
                     'holder_noc': record_noc,
                     'year': record_year
@@ -154,12 +156,14 @@ def parse(root: etree._Element, db: Session):
             constraint='uq_record', 
             set_={
                 'time': stmt.excluded.time,
+                'time_hs': stmt.excluded.time_hs,
                 'holder_name': stmt.excluded.holder_name,
                 'holder_noc': stmt.excluded.holder_noc,
                 'year': stmt.excluded.year
             }
         )
         db.execute(stmt)
+        changes.track(db, 'records', rows=final_records_data) # Índice de récords en memoria (tras commit)
         # db.commit() # Quitado. Se hará en processing.py
         logger.info(f"Procesamiento [parser_records.py] completo. {len(final_records_data)} récords procesados/actualizados.")
 
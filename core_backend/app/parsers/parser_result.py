@@ -2,9 +2,10 @@ import logging
 from lxml import etree
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from .. import models
+from .. import models, changes
 from .id_validators import normalize_unit_id
 from .participant_helpers import ensure_participants_exist
+from .time_helpers import time_to_hundredths
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +70,7 @@ def parse(root: etree._Element, db: Session):
                 'participant_id': participant_id,
                 'rank': int(rank) if rank and rank.isdigit() else None,
                 'time': result_time,
+                'time_hs': time_to_hundredths(result_time), # None si no es un tiempo
                 'irm': irm,
                 'qualification_mark': qual_mark,
                 # Otros campos (diff, reaction_time, splits) se dejan como NULL
@@ -89,11 +91,12 @@ def parse(root: etree._Element, db: Session):
             set_={
                 'rank': stmt_res.excluded.rank,
                 'time': stmt_res.excluded.time,
+                'time_hs': stmt_res.excluded.time_hs,
                 'irm': stmt_res.excluded.irm,
                 'qualification_mark': stmt_res.excluded.qualification_mark
             }
         )
-        db.execute(stmt_res)
+        changes.execute_tracked(db, stmt_res, models.Result)
         
         logger.info(f"Procesamiento genérico [parser_result.py] completo para {unit_id}. {len(results_data)} resultados guardados.")
         db.commit()
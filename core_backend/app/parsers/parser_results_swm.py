@@ -2,11 +2,13 @@ import logging
 from lxml import etree
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from sqlalchemy import update
-from .. import models 
+from sqlalchemy import update, delete
+from .. import models, database, changes
+from ..record_index import index as record_index
 import re # ¡Asegúrate de importar re!
 from .id_validators import extract_event_id_from_unit, normalize_unit_id, validate_event_id
 from .participant_helpers import ensure_participants_exist
+from .time_helpers import time_to_hundredths
 
 log = logging.getLogger(__name__)
 
@@ -43,7 +45,7 @@ def _ensure_event_stub(db: Session, event_id: str):
             name=event_id, # Nombre es solo el ID hasta que DT_CODES lo llene
             gender=gender_code 
         ).on_conflict_do_nothing(index_elements=['event_id'])
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, models.Event)
     except Exception as e:
         log.error(f"Error al asegurar Evento '{event_id}': {e}", exc_info=False)
         pass
@@ -55,7 +57,7 @@ def _ensure_noc_stub(db: Session, noc: str):
         stmt = pg_insert(models.Noc).values(
             noc=noc, long_name=noc, short_name=noc
         ).on_conflict_do_nothing(index_elements=['noc'])
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, models.Noc)
     except Exception as e:
         log.error(f"Error al asegurar NOC '{noc}': {e}", exc_info=False)
         pass
@@ -70,7 +72,7 @@ def _ensure_participant_stub(db: Session, participant_id: str, name: str, noc: s
             noc=noc,
             gender=gender
         ).on_conflict_do_nothing(index_elements=['participant_id'])
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, models.Participant)
     except Exception as e:
         log.error(f"No se pudo asegurar Participante '{participant_id}': {e}", exc_info=False)
         pass
@@ -191,7 +193,7 @@ def _handle_start_list(db: Session, message: etree._Element, unit_id: str):
     if noc_stubs:
         noc_data = [{'noc': n, 'long_name': n, 'short_name': n} for n in noc_stubs]
         stmt_noc = pg_insert(models.Noc).values(noc_data).on_conflict_do_nothing(index_elements=['noc'])
-        db.execute(stmt_noc)
+        changes.execute_tracked(db, stmt_noc, models.Noc)
 
     if participant_ids_in_message:
         created_stub_count = ensure_participants_exist(db, participant_ids_in_message)
@@ -204,7 +206,7 @@ def _handle_start_list(db: Session, message: etree._Element, unit_id: str):
             index_elements=['participant_id'],
             set_={'name': stmt_part.excluded.name, 'noc': stmt_part.excluded.noc}
         )
-        db.execute(stmt_part)
+        changes.execute_tracked(db, stmt_part, models.Participant)
     # -------------
 
     if start_list_data:
@@ -216,7 +218,7 @@ def _handle_start_list(db: Session, message: etree._Element, unit_id: str):
                 'composition': stmt_sl.excluded.composition
             }
         )
-        db.execute(stmt_sl)
+        changes.execute_tracked(db, stmt_sl, models.StartListEntry)
     
     log.info(f"START_LIST: Procesadas {len(start_list_data)} entradas para UnitID={unit_id}")
 
@@ -227,7 +229,9 @@ def _handle_results(db: Session, message: etree._Element, unit_id: str, status:
     (V3.0 - Mantiene IDs completos)
     """
     results_data = []
+    split_rows = []
     participant_ids_in_message = set()
+    event_id = _get_event_id_from_unit_id(unit_id)
     
     result_elements = message.xpath('/OdfBody/Competition/Result')
 
@@ -279,6 +283,8 @@ def _handle_results(db: Session, message: etree._Element, unit_id: str, status:
                 "Rank": split.get('Rank'),
                 "Diff": split.get('Diff')
             })
+            split_row = _build_split_row(unit_id, event_id, participant_id, '', split)
+            if split_row: split_rows.append(split_row)
         
         athlete_elements = competitor.xpath('Composition/Athlete')
         for ath in athlete_elements:
@@ -292,6 +298,8 @@ def _handle_results(db: Session, message: etree._Element, unit_id: str, status:
                     "Rank": split.get('Rank'),
                     "Value2": split.get('Value2') 
                 })
+                split_row = _build_split_row(unit_id, event_id, participant_id, athlete_code, split)
+                if split_row: split_rows.append(split_row)
             if athlete_splits:
                 splits_json["athlete_splits"][athlete_code] = athlete_splits
 
@@ -301,10 +309,14 @@ def _handle_results(db: Session, message: etree._Element, unit_id: str, status:
             'rank': int(rank) if rank and rank.isdigit() else None,
             'time': time,
             'diff': diff,
+            'time_hs': time_to_hundredths(time),
+            'diff_hs': time_to_hundredths(diff),
             'reaction_time': reaction_time,
             'irm': irm,
             'qualification_mark': qual_mark,
-            'splits': splits_json if splits_json["team_splits"] or splits_json["athlete_splits"] else None,
+            # En LIVE los parciales van solo a la tabla 'splits'; el JSONB se consolida en UNOFFICIAL/OFFICIAL.
+            'splits': (splits_json if splits_json["team_splits"] or splits_json["athlete_splits"] else None)
+                      if status != "LIVE" else None,
             'record_mark': record_mark
         })
 
@@ -313,27 +325,121 @@ def _handle_results(db: Session, message: etree._Element, unit_id: str, status:
         if created_stub_count:
             log.info(f"Created {created_stub_count} stub participant(s).")
 
+    # Modo UNLOGGED: los LIVE van a 'live_results'; UNOFFICIAL/OFFICIAL se promocionan a 'results'.
+    live_mode = database.LIVE_RESULTS_UNLOGGED
+    target_model = models.LiveResult if (live_mode and status == "LIVE") else models.Result
+    constraint_name = (
+        '_unit_participant_live_result_uc' if target_model is models.LiveResult
+        else '_unit_participant_result_uc'
+    )
+
     if results_data:
-        stmt_res = pg_insert(models.Result).values(results_data)
+        stmt_res = pg_insert(target_model).values(results_data)
         
+        update_cols = {
+            'rank': stmt_res.excluded.rank,
+            'time': stmt_res.excluded.time,
+            'diff': stmt_res.excluded.diff,
+            'time_hs': stmt_res.excluded.time_hs,
+            'diff_hs': stmt_res.excluded.diff_hs,
+            'reaction_time': stmt_res.excluded.reaction_time,
+            'irm': stmt_res.excluded.irm,
+            'qualification_mark': stmt_res.excluded.qualification_mark,
+            'record_mark': stmt_res.excluded.record_mark 
+        }
+        if status != "LIVE":
+            # Un LIVE no reescribe el JSONB de parciales (ya están en 'splits').
+            update_cols['splits'] = stmt_res.excluded.splits
         stmt_res = stmt_res.on_conflict_do_update(
-            constraint='_unit_participant_result_uc',
-            set_={
-                'rank': stmt_res.excluded.rank,
-                'time': stmt_res.excluded.time,
-                'diff': stmt_res.excluded.diff,
-                'reaction_time': stmt_res.excluded.reaction_time,
-                'irm': stmt_res.excluded.irm,
-                'qualification_mark': stmt_res.excluded.qualification_mark,
-                'splits': stmt_res.excluded.splits,
-                'record_mark': stmt_res.excluded.record_mark 
-            }
+            constraint=constraint_name,
+            set_=update_cols
+        )
+        changes.execute_tracked(db, stmt_res, target_model)
+
+    if split_rows:
+        _store_splits(db, unit_id, split_rows, status)
+
+    # Detección de récords en memoria (antes de que llegue la marca oficial del feed)
+    if event_id and results_data:
+        record_index.ensure_loaded(db)
+        detections = record_index.evaluate(event_id, status, results_data, split_rows)
+        changes.track(db, 'record_breaks', unit_id=unit_id, detections=detections)
+
+    if live_mode and target_model is models.Result:
+        # El estado durable ya está en 'results': el LIVE transitorio sobra.
+        db.execute(
+            delete(models.LiveResult)
+            .where(models.LiveResult.unit_id == unit_id)
+            .execution_options(synchronize_session=False)
         )
-        db.execute(stmt_res)
+        changes.track(db, 'delete', table='live_results', match={'unit_id': unit_id})
     
     log.info(f"{status}: Procesados {len(results_data)} resultados para UnitID={unit_id}")
 
 
+def _build_split_row(unit_id: str, event_id, participant_id: str, athlete_id: str, split: etree._Element):
+    """Convierte un ExtendedResult PROGRESS/INTERMEDIATE en una fila de la tabla 'splits'."""
+    pos = split.get('Pos')
+    if not pos or not pos.strip().isdigit():
+        return None
+    rank = split.get('Rank')
+    return {
+        'unit_id': unit_id,
+        'event_id': event_id,
+        'participant_id': participant_id,
+        'athlete_id': athlete_id or '',
+        'position': int(pos.strip()),
+        'value': split.get('Value'),
+        'value_hs': time_to_hundredths(split.get('Value')),
+        'rank': int(rank) if rank and rank.isdigit() else None,
+        'diff': split.get('Diff'),
+        'value2': split.get('Value2'),
+    }
+
+
+def _store_splits(db: Session, unit_id: str, split_rows: list, status: str):
+    """
+    Inserta solo los parciales nuevos de la unidad.
+    - LIVE: se filtran contra las posiciones ya guardadas (una consulta indexada) y
+      se insertan con DO NOTHING; nunca se reescriben los anteriores.
+    - UNOFFICIAL/OFFICIAL: upsert completo para recoger correcciones del juez.
+    """
+    # De-duplicación (una misma clave dos veces rompe el ON CONFLICT)
+    split_rows = list({
+        (row['participant_id'], row['athlete_id'], row['position']): row for row in split_rows
+    }.values())
+
+    if status == "LIVE":
+        existing = db.query(
+            models.Split.participant_id, models.Split.athlete_id, models.Split.position
+        ).filter(models.Split.unit_id == unit_id).all()
+        existing_keys = {tuple(row) for row in existing}
+        split_rows = [
+            row for row in split_rows
+            if (row['participant_id'], row['athlete_id'], row['position']) not in existing_keys
+        ]
+        if not split_rows:
+            return
+        stmt = pg_insert(models.Split).values(split_rows).on_conflict_do_nothing(
+            constraint='_unit_participant_athlete_split_uc'
+        )
+    else:
+        stmt = pg_insert(models.Split).values(split_rows)
+        stmt = stmt.on_conflict_do_update(
+            constraint='_unit_participant_athlete_split_uc',
+            set_={
+                'value': stmt.excluded.value,
+                'value_hs': stmt.excluded.value_hs,
+                'rank': stmt.excluded.rank,
+                'diff': stmt.excluded.diff,
+                'value2': stmt.excluded.value2,
+            }
+        )
+    # Anotadas para el read model: los LIVE no llevan el JSONB y sus parciales salen de aquí
+    changes.execute_tracked(db, stmt, models.Split)
+    log.debug(f"{status}: {len(split_rows)} parciales guardados para UnitID={unit_id}")
+
+
 def _update_schedule_status(db: Session, unit_id: str, status: str):
     """
     Actualiza el estado de la prueba en la tabla Schedule.
@@ -350,7 +456,7 @@ def _update_schedule_status(db: Session, unit_id: str, status: str):
     )
     
     try:
-        db.execute(stmt)
+        changes.execute_tracked(db, stmt, models.Schedule)
     except Exception as e:
         log.error(f"No se pudo actualizar el estado del schedule para {unit_id}: {e}", exc_info=False)
         pass
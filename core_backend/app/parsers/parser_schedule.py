@@ -3,7 +3,7 @@ from lxml import etree
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy import update
-from .. import models
+from .. import models, changes
 from datetime import datetime
 import re
 from .id_validators import (
@@ -192,7 +192,7 @@ def _process_start_list_in_schedule(db: Session, unit_node: etree._Element, unit
         noc_data = [{'noc': n, 'long_name': n, 'short_name': n} for n in noc_stubs]
         stmt_noc = pg_insert(models.Noc).values(noc_data)
         stmt_noc = stmt_noc.on_conflict_do_nothing(index_elements=['noc'])
-        db.execute(stmt_noc)
+        changes.execute_tracked(db, stmt_noc, models.Noc)
 
     if participant_ids_in_message:
         created_stub_count = ensure_participants_exist(db, participant_ids_in_message)
@@ -205,14 +205,14 @@ def _process_start_list_in_schedule(db: Session, unit_node: etree._Element, unit
             index_elements=['participant_id'],
             set_={'name': stmt_part.excluded.name, 'noc': stmt_part.excluded.noc}
         )
-        db.execute(stmt_part)
+        changes.execute_tracked(db, stmt_part, models.Participant)
     if start_list_data:
         stmt_sl = pg_insert(models.StartListEntry).values(start_list_data)
         stmt_sl = stmt_sl.on_conflict_do_update(
             constraint='_unit_participant_uc',
             set_={'lane': stmt_sl.excluded.lane, 'composition': stmt_sl.excluded.composition}
         )
-        db.execute(stmt_sl)
+        changes.execute_tracked(db, stmt_sl, models.StartListEntry)
         log.info(f"Start list actualizada desde DT_SCHEDULE para UnitID={unit_code} ({len(start_list_data)} entradas).")
 
 # --- Parser Principal ---
@@ -335,7 +335,7 @@ def _parse_codes_event_unit(db: Session, message: etree._Element):
                 'stroke': stmt_event.excluded.stroke
             }
         )
-        db.execute(stmt_event)
+        changes.execute_tracked(db, stmt_event, models.Event)
         log.info(f"[parser_schedule.py] {len(events_data)} Eventos procesados/actualizados.")
     
     # --- ¡SQL CORREGIDO! ---
@@ -351,7 +351,7 @@ def _parse_codes_event_unit(db: Session, message: etree._Element):
             # No tocamos 'start_time' ni 'status'
         }
     )
-    db.execute(stmt_sched)
+    changes.execute_tracked(db, stmt_sched, models.Schedule)
     # -----------------------
     log.info(f"[parser_schedule.py] Procesadas y actualizadas {len(schedule_data)} unidades desde DT_CODES.")
         
@@ -440,7 +440,7 @@ def _parse_schedule_update(db: Session, message: etree._Element):
                 'stroke': stmt_event.excluded.stroke
             }
         )
-        db.execute(stmt_event)
+        changes.execute_tracked(db, stmt_event, models.Event)
         log.info(f"[parser_schedule.py] {len(events_data)} Eventos (stubs) procesados/actualizados.")
 
     # --- ¡SQL CORREGIDO! ---
@@ -456,6 +456,6 @@ def _parse_schedule_update(db: Session, message: etree._Element):
             'unit_num': stmt_sched.excluded.unit_num # ¡Añadido!
         }
     )
-    db.execute(stmt_sched)
+    changes.execute_tracked(db, stmt_sched, models.Schedule)
     # -----------------------
     log.info(f"[parser_schedule.py] Procesadas y actualizadas {len(schedule_data)} unidades desde DT_SCHEDULE_UPDATE.")
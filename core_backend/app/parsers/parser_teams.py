@@ -2,7 +2,7 @@ import logging
 from lxml import etree
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
-from .. import models
+from .. import models, changes
 import re
 
 logger = logging.getLogger(__name__)
@@ -14,7 +14,7 @@ def _ensure_noc_exists(noc: str, db: Session):
     stmt = insert(models.Noc).values(
         noc=noc, long_name=noc, short_name=noc
     ).on_conflict_do_nothing(index_elements=['noc'])
-    db.execute(stmt)
+    changes.execute_tracked(db, stmt, models.Noc)
 
 def _ensure_event_exists(event_id: str, db: Session):
     # ... (código existente - Asegúrate que es la versión
@@ -27,7 +27,7 @@ def _ensure_event_exists(event_id: str, db: Session):
     stmt = insert(models.Event).values(
         event_id=event_id, name=event_id, gender=gender_code
     ).on_conflict_do_nothing(index_elements=['event_id'])
-    db.execute(stmt)
+    changes.execute_tracked(db, stmt, models.Event)
 
 def parse(root: etree._Element, db: Session):
     logger.info("Iniciando parser [parser_teams.py] (v2.3 - con normalización)...")
@@ -60,7 +60,7 @@ def parse(root: etree._Element, db: Session):
                 set_={ 'name': team_node.get('Name'), 'noc': noc,
                        'gender': team_node.get('Gender') }
             )
-            db.execute(stmt_team)
+            changes.execute_tracked(db, stmt_team, models.Participant)
 
             # 2. Parsear <RegisteredEvent>
             reg_events = team_node.xpath(".//RegisteredEvent")
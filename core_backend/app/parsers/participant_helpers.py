@@ -4,7 +4,7 @@ from typing import Iterable, Set
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 
-from .. import models
+from .. import changes, models
 
 log = logging.getLogger(__name__)
 
@@ -47,7 +47,7 @@ def ensure_participants_exist(db: Session, participant_ids: Iterable[str]) -> in
     ]
     stmt = pg_insert(models.Participant).values(stub_participants)
     stmt = stmt.on_conflict_do_nothing(index_elements=["participant_id"])
-    db.execute(stmt)
+    changes.execute_tracked(db, stmt, models.Participant)
 
     log.debug("Created %s stub participant(s): %s", len(stub_participants), new_ids)
     return len(stub_participants)
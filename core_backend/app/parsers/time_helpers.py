@@ -0,0 +1,49 @@
+import re
+from typing import Optional
+
+# "1:52.34", "52.34", "1:02:03.45", "+0.52", "-1:00.10". Always with '.' or ':' ("845" are points)
+_TIME_RE = re.compile(r"^([+-])?(?:(\d+):)?(?:(\d+):)?(\d+)(?:\.(\d{1,3}))?$")
+
+
+def time_to_hundredths(value: Optional[str]) -> Optional[int]:
+    """
+    Convert an ODF time/diff string into integer hundredths of a second.
+
+    Returns None for empty values or marks that are not times (IRM codes, points...).
+    A bare integer ("845", "3") is a score, place or rank, never a time.
+    Diffs keep their sign ("+0.52" -> 52, "-0.30" -> -30).
+    """
+    if not value:
+        return None
+
+    match = _TIME_RE.fullmatch(value.strip())
+    if not match:
+        return None
+
+    sign, first, second, seconds, fraction = match.groups()
+    if first is None and fraction is None:
+        return None
+    if second is not None:
+        hours, minutes = int(first), int(second)
+    else:
+        hours, minutes = 0, int(first) if first is not None else 0
+
+    fraction = (fraction or "").ljust(2, "0")
+    hundredths = int(fraction[:2])
+
+    total = ((hours * 60 + minutes) * 60 + int(seconds)) * 100 + hundredths
+    return -total if sign == "-" else total
+
+
+def hundredths_to_time(value: Optional[int]) -> Optional[str]:
+    """Inverse of time_to_hundredths for display ("1:52.34" / "52.34")."""
+    if value is None:
+        return None
+
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    minutes, rest = divmod(value, 6000)
+    seconds, hundredths = divmod(rest, 100)
+    if minutes:
+        return f"{sign}{minutes}:{seconds:02d}.{hundredths:02d}"
+    return f"{sign}{seconds}.{hundredths:02d}"
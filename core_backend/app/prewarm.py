@@ -0,0 +1,112 @@
+import datetime
+import logging
+import os
+import threading
+from typing import Optional, Set
+
+from . import database, json_generator, models, read_model
+from .on_air import focus as on_air
+from .record_index import index as record_index
+from .shared_snapshot import shared
+from .widget_payloads import payloads as widget_payloads
+
+log = logging.getLogger(__name__)
+
+# Precalentado según el schedule: cuánto antes de start_time se prepara cada unidad.
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "true").lower() in ("1", "true", "yes")
+PREWARM_LEAD_MINUTES = float(os.getenv("PREWARM_LEAD_MINUTES", "15"))
+PREWARM_INTERVAL_SECONDS = float(os.getenv("PREWARM_INTERVAL_SECONDS", "30"))
+# Una unidad OFFICIAL que empezó hace más de esto (y no está en antena) deja de precalentarse.
+PREWARM_EVICT_AFTER_MINUTES = float(os.getenv("PREWARM_EVICT_AFTER_MINUTES", "10"))
+
+
+class Prewarmer:
+    """
+    Hilo que lee del schedule las unidades que empiezan en los próximos PREWARM_LEAD_MINUTES
+    y deja preparado lo que pedirán sus grafismos: récords de la prueba, start list,
+    participantes y payloads de widgets de la unidad y de su prueba. El paquete de /on-air no se
+    guarda aquí: se arma bajo demanda (o al fijar la antena) sobre esos payloads ya cacheados.
+    Las unidades ya OFFICIAL y fuera de antena salen del estado del precalentado. Sus payloads
+    de widgets se quedan: las secciones de widgets de /all-data los vuelven a leer, y sacarlos
+    solo haría que el siguiente commit los reconstruyese.
+    """
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._warmed: Set[str] = set()
+        self._evicted: Set[str] = set() # Ya liberadas: no se repite en cada pasada
+
+    def start(self):
+        if not PREWARM_ENABLED or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="odf-prewarm", daemon=True)
+        self._thread.start()
+        log.info(f"Precalentado de unidades {PREWARM_LEAD_MINUTES:g} min antes de su inicio")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                log.error(f"Error en el precalentado de unidades: {e}", exc_info=True)
+            self._stop.wait(PREWARM_INTERVAL_SECONDS)
+
+    def tick(self, now: datetime.datetime = None):
+        if shared.is_reader:
+            return # Los lectores sirven desde el snapshot compartido: precalienta el escritor
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        horizon = now + datetime.timedelta(minutes=PREWARM_LEAD_MINUTES)
+        cutoff = now - datetime.timedelta(minutes=PREWARM_EVICT_AFTER_MINUTES)
+        db = database.ReadSessionLocal()
+        try:
+            upcoming = (
+                db.query(models.Schedule.unit_id, models.Schedule.event_id)
+                .filter(models.Schedule.start_time <= horizon)
+                .filter(models.Schedule.start_time >= cutoff)
+                .filter(models.Schedule.status != "OFFICIAL")
+                .all()
+            )
+            finished = (
+                db.query(models.Schedule.unit_id, models.Schedule.event_id)
+                .filter(models.Schedule.status == "OFFICIAL")
+                .filter(models.Schedule.start_time < cutoff)
+                .all()
+            )
+            record_index.ensure_loaded(db)
+            for unit_id, event_id in upcoming:
+                self.warm(db, unit_id, event_id)
+        finally:
+            db.close()
+        self.evict(finished)
+
+    def warm(self, db, unit_id: str, event_id: Optional[str]):
+        if read_model.READ_MODEL_ENABLED:
+            # Payloads cacheados en widget_payloads (los leen /all-data y el paquete de /on-air):
+            # si un commit los invalidó, se recalculan aquí y no en la petición
+            widget_payloads.unit(unit_id)
+            if event_id:
+                widget_payloads.event(event_id)
+        elif unit_id not in self._warmed:
+            # Sin read model: las mismas consultas que harán los endpoints, para calentar la BBDD
+            json_generator.query_unit(db, unit_id)
+            if event_id:
+                json_generator.query_event(db, event_id)
+        if unit_id not in self._warmed:
+            self._warmed.add(unit_id)
+            log.info(f"Unidad {unit_id} precalentada")
+
+    def evict(self, finished):
+        finished_ids = {unit_id for unit_id, _ in finished}
+        self._evicted &= finished_ids # Una unidad que deja de estar OFFICIAL se puede volver a liberar
+        unit_ids = finished_ids - set(on_air.units()) - self._evicted
+        if not unit_ids:
+            return
+        self._evicted |= unit_ids
+        evicted = unit_ids & self._warmed
+        self._warmed -= unit_ids
+        if evicted:
+            log.info(f"Unidades terminadas y fuera de antena, dejan de precalentarse: {', '.join(sorted(evicted))}")
+
+
+prewarmer = Prewarmer()
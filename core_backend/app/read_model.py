@@ -0,0 +1,334 @@
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+from . import changes, database, models
+from .json_generator import model_to_dict, splits_from_rows, to_columnar
+from .record_index import index as record_index
+
+log = logging.getLogger(__name__)
+
+# /all-data desde memoria (por defecto). Con "false" se vuelve a json_generator contra BBDD.
+READ_MODEL_ENABLED = os.getenv("READ_MODEL_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Tablas que alimentan /all-data y su clave natural dentro del read model.
+TABLE_KEYS: Dict[str, Tuple[str, ...]] = {
+    "tournament_info": ("id",),
+    "nocs": ("noc",),
+    "events": ("event_id",),
+    "schedule": ("unit_id",),
+    "participants": ("participant_id",),
+    "start_list_entries": ("unit_id", "participant_id"),
+    "results": ("unit_id", "participant_id"),
+    "live_results": ("unit_id", "participant_id"),
+    "medallists": ("event_id", "participant_id"),
+    "medaltally": ("noc",),
+    # No es una sección: da los parciales de los LIVE, que no escriben el JSONB 'splits'
+    "splits": ("unit_id", "participant_id", "athlete_id", "position"),
+}
+
+# Secciones top-level de /all-data, en el orden en que las devuelve json_generator.
+SECTIONS = (
+    "countdown", "champ_title", "timetable", "event_id", "lane_id", "team_id",
+    "start_list_ind", "start_list_team", "winner_id", "new_record", "results",
+    "results_widget", "qualifiers", "phase_summary", "ceremony_id", "presenters", "medal_id",
+    "medal_list", "medal_tally", "raising_flags", "meta", "tournament_info",
+    "start_list", "medallists",
+)
+LIST_PLACEHOLDERS = ("timetable", "medal_tally")
+
+# Secciones que cambian de forma con la codificación columnar.
+COMPACT_SECTIONS = ("results", "meta")
+
+# Lecturas seguidas de una tabla sucia si los commits adelantan a la recarga; si no, queda sucia
+# y la siguiente lectura lo vuelve a intentar.
+RELOAD_ATTEMPTS = 3
+
+# Tablas cuya clave empieza por unit_id: se indexan también por unidad.
+UNIT_TABLES = ("start_list_entries", "results", "live_results", "splits")
+
+TABLE_MODELS = {
+    "tournament_info": models.TournamentInfo,
+    "nocs": models.Noc,
+    "events": models.Event,
+    "schedule": models.Schedule,
+    "participants": models.Participant,
+    "start_list_entries": models.StartListEntry,
+    "results": models.Result,
+    "live_results": models.LiveResult,
+    "medallists": models.Medallist,
+    "medaltally": models.MedalTally,
+    "splits": models.Split,
+}
+
+
+class ReadModel:
+    """
+    Copia en memoria (por proceso) de las tablas que sirve /all-data.
+
+    - Se carga una vez desde BBDD.
+    - Se actualiza de forma incremental con las filas que cada parser escribe
+      (RETURNING de los upserts, vía app.changes tras el commit).
+    - Las filas nunca se mutan: cada actualización crea un dict nuevo, así que un
+      snapshot en construcción no ve estados a medias.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._loading = False
+        self._pending = [] # Lotes confirmados mientras se hacía la carga inicial
+        self._tables: Dict[str, dict] = {name: {} for name in TABLE_KEYS}
+        self._by_unit: Dict[str, dict] = {name: {} for name in UNIT_TABLES}
+        self._dirty = set()
+        # Cambios aplicados por tabla: una recarga que lee la BBDD mientras llega un apply()
+        # no puede pisar ese cambio con su lectura anterior
+        self._generations: Dict[str, int] = {name: 0 for name in TABLE_KEYS}
+
+    @property
+    def active(self) -> bool:
+        """Cargado o cargándose: los lotes confirmados hay que aplicárselos."""
+        return self._loaded or self._loading
+
+    # --- Carga ---
+
+    def _key(self, table: str, row: dict):
+        return tuple(row.get(col) for col in TABLE_KEYS[table])
+
+    def _load_tables(self, table_names):
+        """
+        Lee las tablas de BBDD y las sustituye en memoria. Una tabla que recibió algún apply()
+        durante la lectura se descarta y sigue marcada como sucia (se vuelve a leer).
+        """
+        with self._lock:
+            generations = {name: self._generations[name] for name in table_names}
+        db = database.SessionLocal() # Primario: el read model no debe ir por detrás de la ingesta
+        try:
+            loaded = {}
+            for name in table_names:
+                loaded[name] = {}
+                for obj in db.query(TABLE_MODELS[name]).all():
+                    row = model_to_dict(obj)
+                    loaded[name][self._key(name, row)] = row
+        finally:
+            db.close()
+        with self._lock:
+            overtaken = {name for name in loaded if self._generations[name] != generations[name]}
+            fresh = {name: rows for name, rows in loaded.items() if name not in overtaken}
+            self._tables.update(fresh)
+            for name in UNIT_TABLES:
+                if name in fresh:
+                    by_unit = {}
+                    for key, row in fresh[name].items():
+                        by_unit.setdefault(key[0], {})[key] = row
+                    self._by_unit[name] = by_unit
+            self._dirty.difference_update(fresh)
+            self._dirty.update(overtaken)
+        if overtaken:
+            log.debug("Recarga del read model adelantada por un commit, se repite: " + ", ".join(sorted(overtaken)))
+        return loaded
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    with self._lock:
+                        self._loading = True
+                    loaded = None
+                    try:
+                        loaded = self._load_tables(list(TABLE_KEYS))
+                    finally:
+                        with self._lock:
+                            # Todo en el mismo bloque: un apply() concurrente ve _loading o _loaded,
+                            # nunca ninguno de los dos, y los lotes pendientes se aplican antes que él
+                            self._loading = False
+                            pending, self._pending = self._pending, []
+                            if loaded is not None:
+                                self._loaded = True
+                                for batch in pending:
+                                    self.apply(batch)
+                    log.info("Read model cargado: " + ", ".join(f"{n}={len(r)}" for n, r in loaded.items()))
+        for _ in range(RELOAD_ATTEMPTS):
+            if not self._dirty:
+                break
+            self._load_tables(list(self._dirty))
+
+    def invalidate(self, *table_names):
+        """Fuerza la recarga de tablas escritas por caminos sin RETURNING (p. ej. ORM)."""
+        with self._lock:
+            for name in table_names:
+                if name in TABLE_KEYS:
+                    self._generations[name] += 1
+                    self._dirty.add(name)
+
+    # --- Actualización incremental ---
+
+    def apply(self, batch: list):
+        with self._lock:
+            if self._loading:
+                self._pending.append(batch)
+                return
+            if not self._loaded:
+                return # Aún no cargado: la carga inicial ya leerá el estado confirmado
+            for change in batch:
+                table = change.get("table")
+                if table not in TABLE_KEYS:
+                    continue
+                self._generations[table] += 1
+                target = self._tables[table]
+                by_unit = self._by_unit.get(table)
+                if change["kind"] == "rows":
+                    for row in change["rows"]:
+                        key = self._key(table, row)
+                        target[key] = {**target.get(key, {}), **row}
+                        if by_unit is not None:
+                            by_unit.setdefault(key[0], {})[key] = target[key]
+                elif change["kind"] == "delete":
+                    match = change["match"]
+                    for key in [k for k, row in target.items()
+                                if all(row.get(col) == val for col, val in match.items())]:
+                        del target[key]
+                        if by_unit is not None:
+                            by_unit.get(key[0], {}).pop(key, None)
+                elif change["kind"] == "reload":
+                    self._dirty.add(table)
+
+    # --- Lecturas ---
+
+    def rows(self, table: str) -> list:
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._tables[table].values())
+
+    def get(self, table: str, *key):
+        self.ensure_loaded()
+        return self._tables[table].get(tuple(key))
+
+    def unit_rows(self, table: str, unit_id: str) -> list:
+        """Filas de una tabla por unidad (start list / resultados) sin recorrer toda la tabla."""
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._by_unit[table].get(unit_id, {}).values())
+
+    def _with_live_splits(self, rows) -> list:
+        """Las filas sin JSONB 'splits' (LIVE) llevan los parciales de la tabla 'splits', como json_generator."""
+        grouped = {}
+        merged = []
+        for row in rows:
+            if row.get("splits") is None and self._by_unit["splits"].get(row["unit_id"]):
+                unit_id = row["unit_id"]
+                if unit_id not in grouped:
+                    grouped[unit_id] = {}
+                    for split in self._by_unit["splits"][unit_id].values():
+                        grouped[unit_id].setdefault(split["participant_id"], []).append(split)
+                split_rows = grouped[unit_id].get(row["participant_id"])
+                if split_rows:
+                    row = {**row, "splits": splits_from_rows(split_rows)}
+            merged.append(row)
+        return merged
+
+    def unit_results(self, unit_id: str) -> list:
+        """Resultados de una unidad, con el LIVE no promocionado por encima del durable."""
+        self.ensure_loaded()
+        with self._lock:
+            merged = dict(self._by_unit["results"].get(unit_id, {}))
+            merged.update(self._by_unit["live_results"].get(unit_id, {}))
+            return self._with_live_splits(merged.values())
+
+    def results(self) -> list:
+        """'results' + 'live_results' (el LIVE no promocionado tiene prioridad), como json_generator.query_results."""
+        self.ensure_loaded()
+        with self._lock:
+            merged = dict(self._tables["results"])
+            merged.update(self._tables["live_results"])
+            return self._with_live_splits(merged.values())
+
+    def _columnar(self, table: str, rows) -> dict:
+        columns = [c.name for c in TABLE_MODELS[table].__table__.columns]
+        return to_columnar(columns, ([row.get(c) for c in columns] for row in rows))
+
+    def build_section(self, name: str, compact: bool = False):
+        """
+        Construye una sección top-level de /all-data (mismo contenido que json_generator).
+        compact=True: 'results' y 'meta.participants' en formato columnar.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            if name == "new_record":
+                return record_index.new_record_section()
+
+            if name == "tournament_info":
+                tournament = self._tables["tournament_info"]
+                if tournament:
+                    return tournament[min(tournament)]
+                return {"error": "No tournament info"}
+
+            if name == "medal_tally":
+                nocs = self._tables["nocs"]
+                return sorted(
+                    (
+                        {
+                            "rank": t["rank"],
+                            "flag": nocs[(t["noc"],)]["flag_url_cloud"],
+                            "noc": t["noc"],
+                            "name": nocs[(t["noc"],)]["long_name"],
+                            "golds": t["golds"],
+                            "silvers": t["silvers"],
+                            "bronzes": t["bronzes"],
+                            "total": t["total"],
+                        } for t in self._tables["medaltally"].values() if (t["noc"],) in nocs
+                    ),
+                    key=lambda t: t["rank"],
+                )
+
+            if name == "timetable":
+                events = self._tables["events"]
+                timetable_units = [u for u in self._tables["schedule"].values() if (u.get("event_id"),) in events]
+                # ORDER BY start_time de Postgres: los NULL al final
+                timetable_units.sort(key=lambda u: (u.get("start_time") is None, u.get("start_time") or 0))
+                return [
+                    {
+                        "start_time": u["start_time"].isoformat() if u.get("start_time") else None,
+                        "event": events[(u["event_id"],)]["name"],
+                        "phase": u.get("phase"),
+                    } for u in timetable_units
+                ]
+
+            if name == "start_list":
+                return list(self._tables["start_list_entries"].values())
+
+            if name == "results":
+                merged_results = self.results()
+                if compact:
+                    return self._columnar("results", merged_results)
+                return merged_results
+
+            if name == "medallists":
+                return list(self._tables["medallists"].values())
+
+            if name == "meta":
+                return {
+                    "events": list(self._tables["events"].values()),
+                    "units": list(self._tables["schedule"].values()),
+                    "participants": self._columnar("participants", self._tables["participants"].values()) if compact
+                                    else list(self._tables["participants"].values()),
+                }
+
+            # Secciones reservadas que aún no calcula el backend
+            return [] if name in LIST_PLACEHOLDERS else {}
+
+    def snapshot(self, compact: bool = False) -> dict:
+        """Mismo contenido que json_generator.generate_json, servido desde memoria."""
+        self.ensure_loaded()
+        with self._lock:
+            return {name: self.build_section(name, compact=compact) for name in SECTIONS}
+
+
+model = ReadModel()
+
+
+@changes.on_commit
+def _apply_committed_changes(batch: list):
+    model.apply(batch)
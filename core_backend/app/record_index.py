@@ -0,0 +1,177 @@
+import logging
+import re
+import threading
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import changes, models
+from .parsers.id_validators import normalize_event_id, parse_event_id
+
+log = logging.getLogger(__name__)
+
+# Ej: 100MFR, 4X100MFR, 1500MFR
+_DISTANCE_RE = re.compile(r"^(?:(\d+)X)?(\d+)M")
+
+
+def _event_key(event_id: Optional[str]) -> Optional[str]:
+    """Clave canónica de prueba: DT_RECORD y los UnitID no siempre llegan con el mismo formato."""
+    if not event_id:
+        return None
+    return normalize_event_id(event_id) or event_id.strip()
+
+
+def _distance_match(event_id: Optional[str]):
+    parts = parse_event_id(event_id) if event_id else None
+    return _DISTANCE_RE.match(parts.event_type) if parts is not None else None
+
+
+def event_distance(event_id: Optional[str]) -> Optional[int]:
+    """Distancia total en metros de la prueba (4X100M -> 400)."""
+    match = _distance_match(event_id)
+    if not match:
+        return None
+    legs = int(match.group(1)) if match.group(1) else 1
+    return legs * int(match.group(2))
+
+
+def is_relay_event(event_id: Optional[str]) -> bool:
+    """Prueba de relevos (4X100M...): sus competidores son equipos."""
+    match = _distance_match(event_id)
+    return bool(match and match.group(1))
+
+
+class RecordIndex:
+    """
+    Índice en memoria de los récords vigentes por (prueba, tipo de récord).
+
+    - Se carga una vez desde 'records' y se mantiene al día con cada DT_RECORD confirmado.
+    - Cada resultado/parcial LIVE u OFFICIAL se compara en O(1) contra los récords de su prueba,
+      de modo que "nuevo récord" y "bajo ritmo de récord" se conocen antes de que el feed
+      envíe la marca oficial de récord.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        # event_key -> {record_type: {time_hs, time, holder_name, holder_noc, year}}
+        self._by_event: Dict[str, Dict[str, dict]] = {}
+        # unit_id -> lista de detecciones de la última actualización de la unidad
+        self._detections: Dict[str, List[dict]] = {}
+
+    # --- Carga / mantenimiento ---
+
+    def ensure_loaded(self, db: Session):
+        if self._loaded:
+            return
+        rows = db.query(models.Record).all()
+        with self._lock:
+            if self._loaded:
+                return
+            for r in rows:
+                self._store(r.event_id, r.record_type, {
+                    "time": r.time, "time_hs": r.time_hs,
+                    "holder_name": r.holder_name, "holder_noc": r.holder_noc, "year": r.year,
+                })
+            self._loaded = True
+        log.info(f"Índice de récords cargado: {len(rows)} récords.")
+
+    def _store(self, event_id: str, record_type: str, record: dict):
+        key = _event_key(event_id)
+        if not key or not record_type:
+            return
+        self._by_event.setdefault(key, {})[record_type] = record
+
+    def update(self, rows: List[dict]):
+        """Aplica filas de récords ya confirmadas en BBDD (formato de parser_records)."""
+        with self._lock:
+            for row in rows:
+                self._store(row["event_id"], row["record_type"], {
+                    "time": row.get("time"), "time_hs": row.get("time_hs"),
+                    "holder_name": row.get("holder_name"), "holder_noc": row.get("holder_noc"),
+                    "year": row.get("year"),
+                })
+
+    def set_detections(self, unit_id: str, detections: List[dict]):
+        with self._lock:
+            if detections:
+                self._detections[unit_id] = detections
+            else:
+                self._detections.pop(unit_id, None)
+
+    # --- Consultas ---
+
+    def records_for_event(self, event_id: str) -> Dict[str, dict]:
+        return self._by_event.get(_event_key(event_id), {})
+
+    def evaluate(self, event_id: str, status: str, results: List[dict], splits: List[dict]) -> List[dict]:
+        """
+        Compara resultados (time_hs) y parciales de equipo/individuales (value_hs) con los récords
+        de la prueba. Devuelve la lista de detecciones para la unidad.
+        """
+        records = self.records_for_event(event_id)
+        if not records:
+            return []
+
+        detections = []
+        for res in results:
+            time_hs = res.get("time_hs")
+            if time_hs is None or res.get("irm"):
+                continue
+            for record_type, rec in records.items():
+                rec_hs = rec.get("time_hs")
+                if rec_hs is None or time_hs > rec_hs:
+                    continue
+                detections.append({
+                    "kind": "NEW_RECORD" if time_hs < rec_hs else "EQUAL_RECORD",
+                    "participant_id": res["participant_id"],
+                    "record_type": record_type,
+                    "time": res.get("time"),
+                    "record_time": rec.get("time"),
+                    "record_holder": rec.get("holder_name"),
+                    "status": status,
+                })
+
+        total_distance = event_distance(event_id)
+        if total_distance:
+            for split in splits:
+                # Solo parciales acumulados del competidor (no los de cada relevista)
+                if split.get("athlete_id") or split.get("value_hs") is None:
+                    continue
+                position = split["position"]
+                if position <= 0 or position >= total_distance:
+                    continue
+                for record_type, rec in records.items():
+                    rec_hs = rec.get("time_hs")
+                    if rec_hs is None:
+                        continue
+                    pace_hs = rec_hs * position // total_distance
+                    if split["value_hs"] < pace_hs:
+                        detections.append({
+                            "kind": "UNDER_RECORD_PACE",
+                            "participant_id": split["participant_id"],
+                            "record_type": record_type,
+                            "position": position,
+                            "time": split.get("value"),
+                            "record_pace_hs": pace_hs,
+                            "record_time": rec.get("time"),
+                            "status": status,
+                        })
+        return detections
+
+    def new_record_section(self) -> dict:
+        """Contenido de la sección 'new_record' de json_generator: {unit_id: [detecciones]}."""
+        with self._lock:
+            return {unit_id: list(dets) for unit_id, dets in self._detections.items()}
+
+
+index = RecordIndex()
+
+
+@changes.on_commit
+def _apply_committed_changes(batch: list):
+    for change in batch:
+        if change["kind"] == "records":
+            index.update(change["rows"])
+        elif change["kind"] == "record_breaks":
+            index.set_detections(change["unit_id"], change["detections"])
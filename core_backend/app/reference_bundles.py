@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from . import changes
+from .compression import COMPRESSION_MIN_SIZE, compress
+from .json_generator import encode_json
+from .read_model import TABLE_KEYS, model as read_model
+
+log = logging.getLogger(__name__)
+
+# Bundles de datos de referencia -> tabla del read model de la que salen.
+BUNDLES = {
+    "participants": "participants",
+    "nocs": "nocs",
+    "events": "events",
+    "units": "schedule",
+}
+
+# El contenido de una URL con hash no cambia nunca: el cliente puede cachearla para siempre.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Versiones anteriores que se siguen sirviendo (clientes que aún piden el hash previo).
+BUNDLE_HISTORY = 4
+
+
+class ReferenceBundles:
+    """
+    Tablas de referencia (participantes, NOCs, pruebas, unidades) publicadas como bundles
+    inmutables direccionados por el hash de su contenido.
+
+    - Un bundle solo se recalcula cuando una ingesta toca su tabla.
+    - /all-data (bundles=true) y el websocket solo llevan los hashes; el cliente descarga
+      el bundle una vez por cambio.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._current: Dict[str, str] = {}
+        self._dirty = set(BUNDLES)
+        # nombre -> {hash: body}, de más antiguo a más reciente
+        self._blobs: Dict[str, OrderedDict] = {name: OrderedDict() for name in BUNDLES}
+        # (hash, encoding) -> body comprimido
+        self._encoded: Dict[Tuple[str, str], bytes] = {}
+
+    def _build(self, name: str) -> Tuple[str, bytes]:
+        table = BUNDLES[name]
+        keys = TABLE_KEYS[table]
+        # Orden estable: el mismo contenido produce siempre el mismo hash
+        rows = sorted(read_model.rows(table), key=lambda r: [str(r.get(k) or "") for k in keys])
+        blob = encode_json(rows)
+        return hashlib.sha256(blob).hexdigest()[:16], blob
+
+    def current(self, name: str) -> Tuple[str, bytes]:
+        """(hash, body) vigentes de un bundle."""
+        with self._lock:
+            if name not in self._dirty:
+                digest = self._current[name]
+                return digest, self._blobs[name][digest]
+            generation = self._generation
+        digest, blob = self._build(name)
+        with self._lock:
+            blobs = self._blobs[name]
+            blobs[digest] = blob
+            blobs.move_to_end(digest)
+            while len(blobs) > BUNDLE_HISTORY:
+                old, _ = blobs.popitem(last=False)
+                for encoding in ("gzip", "br"):
+                    self._encoded.pop((old, encoding), None)
+            self._current[name] = digest
+            # Si hubo otra ingesta mientras se construía, el bundle sigue pendiente
+            if generation == self._generation:
+                self._dirty.discard(name)
+        return digest, blob
+
+    def hashes(self) -> Dict[str, str]:
+        return {name: self.current(name)[0] for name in BUNDLES}
+
+    def refs(self) -> Dict[str, dict]:
+        """Lo que viaja en /all-data y por el websocket en lugar de las tablas completas."""
+        return {
+            name: {"hash": digest, "url": f"/bundles/{name}/{digest}"}
+            for name, digest in self.hashes().items()
+        }
+
+    def get(self, name: str, digest: str, encoding: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """Body de un bundle concreto (actual o reciente) en la codificación pedida: (body, encoding)."""
+        if name not in BUNDLES:
+            return None, None
+        self.current(name)
+        with self._lock:
+            blob = self._blobs[name].get(digest)
+            if blob is None:
+                return None, None
+            if not encoding or len(blob) < COMPRESSION_MIN_SIZE:
+                return blob, None
+            encoded = self._encoded.get((digest, encoding))
+        if encoded is None:
+            # Inmutable: se comprime una sola vez por hash
+            encoded = compress(blob, encoding)
+            with self._lock:
+                self._encoded[(digest, encoding)] = encoded
+        return encoded, encoding
+
+    def invalidate(self, names):
+        with self._lock:
+            self._generation += 1
+            self._dirty.update(name for name in names if name in BUNDLES)
+
+
+bundles = ReferenceBundles()
+
+
+@changes.on_commit
+def _invalidate_committed_changes(batch: list):
+    touched = set()
+    for change in batch:
+        table = change.get("table")
+        touched |= {name for name, source in BUNDLES.items() if source == table}
+    if touched:
+        bundles.invalidate(touched)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 class TournamentInfoBase(BaseModel):
     name: str
@@ -15,3 +15,7 @@ class TournamentInfo(TournamentInfoBase):
 
     class Config:
         orm_mode = True
+
+class OnAirUpdate(BaseModel):
+    current: Optional[str] = None
+    next: List[str] = []
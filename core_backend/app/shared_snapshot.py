@@ -0,0 +1,524 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import changes
+from .compression import SUPPORTED_ENCODINGS
+from .read_model import COMPACT_SECTIONS, SECTIONS
+from .reference_bundles import BUNDLE_HISTORY, BUNDLES, bundles as reference_bundles
+from .snapshot_cache import cache as snapshot_cache
+from .websockets import ALL_TOPIC, manager
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+log = logging.getLogger(__name__)
+
+# Snapshot de /all-data compartido entre workers de uvicorn mediante ficheros mapeados en memoria.
+SHARED_SNAPSHOT = os.getenv("SHARED_SNAPSHOT", "false").lower() in ("1", "true", "yes")
+SHARED_SNAPSHOT_DIR = os.getenv("SHARED_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "odf_snapshot"))
+# Cada cuánto (ms) miran los lectores si el escritor ha publicado mensajes de /ws nuevos.
+SHARED_POLL_MS = float(os.getenv("SHARED_POLL_MS", "20"))
+# Cada cuánto (s) reintentan los lectores el lock de escritor: si el escritor muere, otro lo releva.
+SHARED_WRITER_RETRY_SECONDS = float(os.getenv("SHARED_WRITER_RETRY_SECONDS", "2"))
+# Segmentos antiguos que se conservan por variante (lectores que aún los estén sirviendo).
+SEGMENT_HISTORY = 4
+# Mensajes de /ws que se conservan para los lectores; uno que se queda más atrás hace resync.
+MESSAGE_HISTORY = 1024
+# Un lector que no refresca su fichero de suscripciones en este tiempo se da por muerto.
+SUBSCRIPTIONS_TTL = 30
+# Windows no deja reemplazar un fichero que otro proceso tiene abierto: se reintenta.
+REPLACE_RETRIES = 5
+
+# Variantes publicadas, mismo orden en todos los procesos:
+#   ("full", compact, bundles, encoding)  /all-data completo
+#   ("section", nombre, compact)          una sección (?sections=, snapshots parciales de /ws)
+VARIANTS = [
+    ("full", compact, bundles, encoding)
+    for compact in (False, True)
+    for bundles in (False, True)
+    for encoding in (None,) + SUPPORTED_ENCODINGS
+] + [
+    ("section", name, compact)
+    for name in SECTIONS + ("meta_bundles",)
+    for compact in ((False, True) if name in COMPACT_SECTIONS else (False,))
+]
+_INDEX = {variant: index for index, variant in enumerate(VARIANTS)}
+# Otra lista de variantes (otra versión del código) usa otro fichero de control.
+_LAYOUT = zlib.crc32(repr(VARIANTS).encode("utf-8"))
+
+# Fichero de control: slot del registro de mensajes y un slot por variante.
+# seq impar = el escritor está cambiando el slot (seqlock): el lector reintenta.
+_LOG_SLOT = struct.Struct("<QQQQ") # (seq, último mensaje, versión de delta, boot)
+_SLOT = struct.Struct("<QQQ")      # (seq, versión, id de segmento)
+_HEADER = struct.Struct("<I")      # Longitud de la cabecera JSON al inicio de segmentos y mensajes
+_SPIN_LIMIT = 10000
+
+
+class SharedSnapshot:
+    """
+    Un proceso (el que consigue el lock) es el escritor: mantiene el read model, construye
+    los deltas y publica cada versión del snapshot, ya serializada y comprimida, en segmentos
+    mapeados en memoria. El resto de workers (lectores) no cargan el read model:
+
+    - /all-data, ?sections= y los snapshots de /ws se sirven desde los segmentos, sin copia
+      (memoryview sobre el mmap). Cada segmento es inmutable y lleva el boot / versión de
+      delta leídos antes de renderizarlo.
+    - Los mensajes de /ws (deltas y updates por topic) los escribe el escritor en un registro
+      de ficheros numerados; los lectores los reenvían a sus clientes con la misma numeración.
+    - Los bundles de referencia se escriben como ficheros inmutables por hash.
+    - Cada lector publica sus topics suscritos: el escritor construye también los updates
+      que solo piden clientes de otros workers.
+    - Los lectores reintentan el lock periódicamente: si el escritor muere, uno lo releva
+      (carga el read model, publica y sus clientes hacen resync por el cambio de boot).
+    """
+
+    def __init__(self, directory: str = SHARED_SNAPSHOT_DIR):
+        self.directory = directory
+        self.is_writer = False
+        self._lock_file = None
+        self._control: Optional[mmap.mmap] = None
+        self._segments: Dict[int, tuple] = {} # variante -> (id, body, cabecera) del segmento abierto
+        self._wake = threading.Event()
+        self._next_id = time.time_ns()
+        self._published: Dict[int, list] = {}
+        self._bundle_files: Dict[str, list] = {name: [] for name in BUNDLES}
+        self._log_lock = threading.Lock()
+        self._last_message = 0
+        self._subscriptions: Optional[Set[str]] = None
+        self._remote: Tuple[Optional[tuple], Set[str]] = (None, set())
+        self._promote_hooks: List[Callable[[], None]] = []
+        # Enganches que fija app.deltas: estado del registro de deltas y cómo reproducir mensajes
+        self.delta_state: Callable[[], Tuple[str, int]] = lambda: ("00000000", 0)
+        self.on_message: Optional[Callable[[str, Optional[int], tuple, str], None]] = None
+        self.on_resync: Optional[Callable[[str, int], None]] = None
+
+    @property
+    def is_reader(self) -> bool:
+        return self._control is not None and not self.is_writer
+
+    def on_promote(self, hook: Callable[[], None]):
+        """Registra lo que un lector debe arrancar al convertirse en escritor."""
+        self._promote_hooks.append(hook)
+        return hook
+
+    # --- Arranque ---
+
+    def _path(self, *parts) -> str:
+        return os.path.join(self.directory, *parts)
+
+    def start(self):
+        for sub in ("messages", "bundles", "subscriptions", "blobs"):
+            os.makedirs(self._path(sub), exist_ok=True)
+        control_path = self._path(f"control-{_LAYOUT:08x}.bin")
+        size = _LOG_SLOT.size + _SLOT.size * len(VARIANTS)
+        with open(control_path, "ab") as f:
+            if f.tell() < size:
+                f.write(b"\0" * (size - f.tell()))
+        with open(control_path, "r+b") as f:
+            self._control = mmap.mmap(f.fileno(), size)
+        if self._try_lock():
+            log.info(f"Snapshot compartido: este worker publica en {self.directory}")
+            self._become_writer()
+            self._start_publisher()
+        else:
+            log.info(f"Snapshot compartido: este worker sirve desde {self.directory}")
+            state = self._read_log_slot()
+            if state is not None:
+                self._last_message = state[0]
+                if state[2] and self.on_resync is not None:
+                    self.on_resync(f"{state[2]:08x}", state[1]) # Misma numeración que el escritor
+            manager.subscriptions_changed = self._write_subscriptions
+            threading.Thread(target=self._follow, name="odf-shared-follow", daemon=True).start()
+
+    def _try_lock(self) -> bool:
+        lock_file = open(self._path("writer.lock"), "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file # El lock se mantiene mientras viva el proceso
+        return True
+
+    def _become_writer(self):
+        state = self._read_log_slot()
+        self._last_message = state[0] if state else 0 # Se sigue la numeración del escritor anterior
+        self.is_writer = True
+        manager.subscriptions_changed = None
+        manager.remote_topics = self._remote_topics
+        self._remove_subscriptions()
+
+    def _start_publisher(self):
+        threading.Thread(target=self._publisher, name="odf-shared-snapshot", daemon=True).start()
+        self._wake.set()
+
+    def _promote(self):
+        log.warning("Snapshot compartido: el worker escritor ya no tiene el lock; este worker pasa a publicar")
+        self._become_writer()
+        # Antes de publicar segmentos: que ya lleven el boot nuevo
+        for hook in self._promote_hooks:
+            try:
+                hook()
+            except Exception as e:
+                log.error(f"Error al pasar a worker escritor: {e}", exc_info=True)
+        self._start_publisher()
+
+    # --- Seqlock ---
+
+    def _read_locked(self, fmt: struct.Struct, offset: int) -> Optional[tuple]:
+        for _ in range(_SPIN_LIMIT):
+            values = fmt.unpack_from(self._control, offset)
+            if values[0] % 2 == 0 and fmt.unpack_from(self._control, offset)[0] == values[0]:
+                return values[1:]
+        return None # Escritor muerto a mitad de escritura: lo arreglará el siguiente
+
+    def _write_locked(self, fmt: struct.Struct, offset: int, *values):
+        current = fmt.unpack_from(self._control, offset)
+        odd = current[0] + 1 | 1 # Impar aunque el escritor anterior muriese a mitad
+        fmt.pack_into(self._control, offset, odd, *current[1:])
+        fmt.pack_into(self._control, offset, odd + 1, *values)
+
+    def _read_log_slot(self) -> Optional[tuple]:
+        return self._read_locked(_LOG_SLOT, 0)
+
+    def _read_slot(self, index: int) -> Optional[tuple]:
+        return self._read_locked(_SLOT, _LOG_SLOT.size + index * _SLOT.size)
+
+    # --- Escritor: segmentos ---
+
+    def notify_changed(self):
+        if self.is_writer:
+            self._wake.set()
+
+    def _publisher(self):
+        cleaned = False
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                for index, variant in enumerate(VARIANTS):
+                    self._publish(index, variant)
+                self._publish_bundles()
+                if not cleaned:
+                    self._remove_orphans() # Lo que dejó un escritor anterior
+                    cleaned = True
+            except Exception as e:
+                log.error(f"Error publicando el snapshot compartido: {e}", exc_info=True)
+
+    def _segment_path(self, index: int, segment_id: int) -> str:
+        return self._path(f"{index}-{segment_id}.seg")
+
+    def _publish(self, index: int, variant):
+        if variant[0] == "full":
+            _, compact, bundles, encoding = variant
+            version = snapshot_cache.version
+        else:
+            _, name, compact = variant
+            version = snapshot_cache.section_versions()[name]
+        current = self._read_slot(index)
+        if current is not None and current[0] == version and index in self._published:
+            return # Esta variante ya está publicada para la versión actual
+        boot, delta_version = self.delta_state() # Antes de renderizar: el body es al menos así de nuevo
+        if variant[0] == "full":
+            body, etag, used = snapshot_cache.render_encoded(compact=compact, encoding=encoding, bundles=bundles)
+        else:
+            _, body = snapshot_cache.section_bytes(name, compact)
+            etag, used = None, None
+        self._next_id += 1
+        segment_id = self._next_id
+        path = self._segment_path(index, segment_id)
+        header = json.dumps({"etag": etag, "encoding": used, "boot": boot, "version": delta_version}).encode("utf-8")
+        with open(path + ".tmp", "wb") as f:
+            f.write(_HEADER.pack(len(header)) + header + body)
+        os.replace(path + ".tmp", path)
+        self._write_locked(_SLOT, _LOG_SLOT.size + index * _SLOT.size, version, segment_id) # Swap del puntero
+        history = self._published.setdefault(index, [])
+        history.append(segment_id)
+        while len(history) > SEGMENT_HISTORY:
+            old = history.pop(0)
+            try:
+                os.remove(self._segment_path(index, old))
+            except OSError:
+                history.insert(0, old) # En uso (Windows): se reintenta en la próxima publicación
+                break
+
+    def _bundle_path(self, name: str, digest: str, encoding: Optional[str] = None) -> str:
+        return self._path("bundles", f"{name}-{digest}" + (f".{encoding}" if encoding else ""))
+
+    def _publish_bundles(self):
+        for name in BUNDLES:
+            digest, _ = reference_bundles.current(name)
+            files = self._bundle_files[name]
+            if digest in files:
+                continue
+            for encoding in (None,) + SUPPORTED_ENCODINGS:
+                body, used = reference_bundles.get(name, digest, encoding)
+                path = self._bundle_path(name, digest, used)
+                if body is not None and not os.path.exists(path):
+                    with open(path + ".tmp", "wb") as f:
+                        f.write(body)
+                    os.replace(path + ".tmp", path)
+            files.append(digest)
+            while len(files) > BUNDLE_HISTORY:
+                old = files.pop(0)
+                for encoding in (None,) + SUPPORTED_ENCODINGS:
+                    try:
+                        os.remove(self._bundle_path(name, old, encoding))
+                    except OSError:
+                        pass
+
+    def _remove_orphans(self):
+        live = {os.path.basename(self._segment_path(i, s)) for i, ids in self._published.items() for s in ids}
+        live |= {
+            os.path.basename(self._bundle_path(name, digest, encoding))
+            for name, digests in self._bundle_files.items() for digest in digests
+            for encoding in (None,) + SUPPORTED_ENCODINGS
+        }
+        for folder, suffix in ((self.directory, ".seg"), (self._path("bundles"), "")):
+            for entry in os.listdir(folder):
+                if entry.endswith(suffix) and entry not in live and os.path.isfile(os.path.join(folder, entry)):
+                    try:
+                        os.remove(os.path.join(folder, entry))
+                    except OSError:
+                        pass # En uso (Windows)
+
+    # --- Escritor: mensajes de /ws ---
+
+    def _message_path(self, number: int) -> str:
+        return self._path("messages", f"{number}.msg")
+
+    def append_message(self, message: str, topics: Iterable[str], boot: Optional[str] = None,
+                       version: Optional[int] = None):
+        """Deja un mensaje de /ws para los clientes de los lectores (version: la del delta, si lo es)."""
+        current_boot, current_version = self.delta_state()
+        boot = boot or current_boot
+        delta_version = version if version is not None else current_version
+        header = json.dumps({"topics": list(topics), "boot": boot, "version": version}).encode("utf-8")
+        with self._log_lock:
+            number = self._last_message + 1
+            path = self._message_path(number)
+            with open(path + ".tmp", "wb") as f:
+                f.write(_HEADER.pack(len(header)) + header + message.encode("utf-8"))
+            os.replace(path + ".tmp", path)
+            self._last_message = number
+            self._write_locked(_LOG_SLOT, 0, number, delta_version, int(boot, 16))
+            try:
+                os.remove(self._message_path(number - MESSAGE_HISTORY))
+            except OSError:
+                pass
+
+    # --- Escritor: otros datos ya serializados (estado en antena...) ---
+
+    def _blob_path(self, name: str) -> str:
+        if os.path.basename(name) != name:
+            raise ValueError(f"Nombre de fichero compartido no válido: {name}")
+        return self._path("blobs", name)
+
+    def write_blob(self, name: str, body: bytes):
+        path = self._blob_path(name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        for attempt in range(REPLACE_RETRIES):
+            try:
+                os.replace(tmp, path)
+                return
+            except PermissionError:
+                if attempt == REPLACE_RETRIES - 1:
+                    os.remove(tmp)
+                    raise
+                time.sleep(0.05)
+
+    def remove_blob(self, name: str):
+        try:
+            os.remove(self._blob_path(name))
+        except OSError:
+            pass
+
+    # --- Escritor: suscripciones de los lectores ---
+
+    def _remote_topics(self) -> Set[str]:
+        folder = self._path("subscriptions")
+        stamp = (os.stat(folder).st_mtime_ns, int(time.monotonic())) # Se relee al menos cada segundo
+        if self._remote[0] == stamp:
+            return self._remote[1]
+        topics = set()
+        for entry in os.listdir(folder):
+            path = os.path.join(folder, entry)
+            try:
+                if time.time() - os.path.getmtime(path) > SUBSCRIPTIONS_TTL:
+                    os.remove(path) # Lector muerto
+                    continue
+                with open(path, "rb") as f:
+                    topics.update(json.loads(f.read()))
+            except (OSError, ValueError):
+                continue # Reemplazado o borrado mientras se leía
+        self._remote = (stamp, topics)
+        return topics
+
+    # --- Lectores ---
+
+    def _subscriptions_path(self) -> str:
+        return self._path("subscriptions", f"{os.getpid()}.json")
+
+    def _write_subscriptions(self, topics: Set[str]):
+        if topics == self._subscriptions:
+            return
+        self._subscriptions = set(topics)
+        path = self._subscriptions_path()
+        tmp = f"{path}.{threading.get_ident()}.tmp" # Lo escriben el bucle de eventos y el hilo del lector
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(sorted(topics)).encode("utf-8"))
+        os.replace(tmp, path)
+
+    def _remove_subscriptions(self):
+        try:
+            os.remove(self._subscriptions_path())
+        except OSError:
+            pass
+
+    def _follow(self):
+        """Hilo del lector: reenvía los mensajes del escritor y reintenta el lock de escritor."""
+        retry_at = touch_at = time.monotonic()
+        while not self.is_writer:
+            time.sleep(SHARED_POLL_MS / 1000)
+            try:
+                self._read_messages()
+                now = time.monotonic()
+                if now >= touch_at and self._subscriptions is not None:
+                    # Se reescribe (sigue vivo), también si el escritor lo borró por antiguo
+                    topics, self._subscriptions = self._subscriptions, None
+                    self._write_subscriptions(topics)
+                    touch_at = now + SUBSCRIPTIONS_TTL / 3
+                if now >= retry_at:
+                    retry_at = now + SHARED_WRITER_RETRY_SECONDS
+                    if self._try_lock():
+                        self._read_messages() # Lo último que dejó el escritor anterior
+                        self._promote()
+            except Exception as e:
+                log.error(f"Error leyendo del snapshot compartido: {e}", exc_info=True)
+
+    def _read_messages(self):
+        state = self._read_log_slot()
+        if state is None or state[0] <= self._last_message:
+            return
+        last, version, boot = state
+        for number in range(self._last_message + 1, last + 1):
+            try:
+                with open(self._message_path(number), "rb") as f:
+                    raw = f.read()
+            except OSError:
+                # Ya rotado: este lector se ha quedado atrás, sus clientes recargan el snapshot
+                log.warning("Snapshot compartido: mensajes de /ws perdidos, se pide resync a los clientes")
+                self._last_message = last
+                if self.on_resync is not None:
+                    self.on_resync(f"{boot:08x}", version)
+                return
+            header_len = _HEADER.unpack_from(raw)[0]
+            header = json.loads(raw[_HEADER.size:_HEADER.size + header_len])
+            self._last_message = number
+            if self.on_message is not None:
+                self.on_message(header["boot"], header["version"], tuple(header["topics"]),
+                                raw[_HEADER.size + header_len:].decode("utf-8"))
+
+    def _segment(self, index: int) -> Optional[tuple]:
+        slot = self._read_slot(index)
+        if slot is None or slot[1] == 0:
+            return None
+        segment_id = slot[1]
+        cached = self._segments.get(index)
+        if cached is None or cached[0] != segment_id:
+            try:
+                with open(self._segment_path(index, segment_id), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None # Ya rotado: la petición se sirve en local
+            view = memoryview(mapped)
+            header_len = _HEADER.unpack_from(view)[0]
+            header = json.loads(bytes(view[_HEADER.size:_HEADER.size + header_len]))
+            # El mmap anterior se libera cuando ya no lo usa ninguna respuesta en curso
+            cached = (segment_id, view[_HEADER.size + header_len:], header)
+            self._segments[index] = cached
+        return cached
+
+    def read(self, compact: bool, bundles: bool, encoding: Optional[str]) -> Optional[tuple]:
+        """(body, etag, content-encoding, boot, versión de delta) de la última versión publicada, o None."""
+        if self._control is None:
+            return None
+        segment = self._segment(_INDEX[("full", compact, bundles, encoding)])
+        if segment is None:
+            return None
+        _, body, header = segment
+        return body, header["etag"], header["encoding"], header["boot"], header["version"]
+
+    def read_sections(self, names: Iterable[str], compact: bool = False) -> Optional[tuple]:
+        """(body, boot, versión de delta) con solo esas secciones, o None si falta alguna."""
+        if self._control is None:
+            return None
+        parts, boot, version = [], None, None
+        for name in names:
+            segment = self._segment(_INDEX[("section", name, compact and name in COMPACT_SECTIONS)])
+            if segment is None:
+                return None
+            _, body, header = segment
+            # La versión del conjunto es la del segmento más antiguo
+            if version is None or header["version"] < version:
+                boot, version = header["boot"], header["version"]
+            parts.append(b'"' + name.encode("utf-8") + b'":' + bytes(body))
+        return b"{" + b",".join(parts) + b"}", boot, version
+
+    def read_blob(self, name: str) -> Optional[bytes]:
+        if self._control is None:
+            return None
+        try:
+            with open(self._blob_path(name), "rb") as f:
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+    def bundle_refs(self) -> Optional[dict]:
+        segment = self._segment(_INDEX[("section", "meta_bundles", False)]) if self._control is not None else None
+        return json.loads(bytes(segment[1]))["bundles"] if segment is not None else None
+
+    def read_bundle(self, name: str, digest: str, encoding: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """Body de un bundle publicado por el escritor: (body, encoding), o (None, None)."""
+        if name not in BUNDLES or not digest.isalnum():
+            return None, None
+        for used in ((encoding, None) if encoding else (None,)):
+            try:
+                with open(self._bundle_path(name, digest, used), "rb") as f:
+                    return f.read(), used # Sin variante comprimida: el bundle es pequeño
+            except OSError:
+                continue
+        return None, None
+
+
+shared = SharedSnapshot()
+
+
+def broadcast(message: str, topics: Iterable[str] = (ALL_TOPIC,), boot: Optional[str] = None,
+              version: Optional[int] = None):
+    """Publica en los websockets de este proceso y, si es el escritor, en los de los lectores."""
+    manager.publish(message, topics)
+    if shared.is_writer:
+        shared.append_message(message, topics, boot, version)
+
+
+@changes.on_commit
+def _publish_committed_changes(batch: list):
+    shared.notify_changed()
@@ -0,0 +1,183 @@
+import logging
+import threading
+import uuid
+from typing import Dict, Iterable, Optional, Tuple
+
+from . import changes
+from .compression import COMPRESSION_MIN_SIZE, compress
+from .json_generator import encode_json
+from .read_model import COMPACT_SECTIONS, SECTIONS, model as read_model
+from .reference_bundles import bundles as reference_bundles
+from .widget_payloads import WIDGET_SECTIONS, payloads as widget_payloads
+
+log = logging.getLogger(__name__)
+
+# Qué tablas (o tipos de cambio) alimentan cada sección de /all-data.
+SECTION_DEPENDENCIES: Dict[str, Tuple[str, ...]] = {
+    "tournament_info": ("tournament_info",),
+    "medal_tally": ("medaltally", "nocs"),
+    "timetable": ("schedule", "events"),
+    "start_list": ("start_list_entries",),
+    "results": ("results", "live_results", "splits"),
+    "medallists": ("medallists",),
+    "meta": ("events", "schedule", "participants"),
+    # 'meta' con solo los hashes de los bundles de referencia (bundles=true)
+    "meta_bundles": ("events", "schedule", "participants", "nocs"),
+    "new_record": ("record_breaks",),
+}
+# Payloads de widgets: solo los datos de referencia cambian todas las unidades a la vez.
+SECTION_DEPENDENCIES.update({name: ("events", "participants", "nocs") for name in WIDGET_SECTIONS})
+# Estas tablas cambian el payload de las unidades / pruebas tocadas, no el de todas: el delta
+# lleva esos payloads (app.deltas) y la sección no se da por obsoleta para los clientes.
+UNIT_WIDGET_SOURCES = (
+    "schedule", "start_list_entries", "results", "live_results", "splits", "medallists", "record_breaks",
+)
+
+
+def build_section(name: str, compact: bool = False):
+    if name == "meta_bundles":
+        return {"bundles": reference_bundles.refs()}
+    if name in WIDGET_SECTIONS:
+        return widget_payloads.build_section(name)
+    return read_model.build_section(name, compact=compact)
+
+
+def sections_for_change(change: dict) -> set:
+    """Secciones que un cliente debe volver a pedir (las de widgets, solo si cambian en bloque)."""
+    source = change.get("table") or change["kind"]
+    sections = {section for section, deps in SECTION_DEPENDENCIES.items() if source in deps}
+    if change["kind"] == "reload" and source in UNIT_WIDGET_SOURCES:
+        sections.update(WIDGET_SECTIONS) # Tabla recargada entera: no se sabe qué unidades cambian
+    return sections
+
+
+def invalidated_sections(change: dict) -> set:
+    """Secciones cuyo contenido completo en /all-data cambia (incluye las de widgets por unidad)."""
+    sections = sections_for_change(change)
+    if (change.get("table") or change["kind"]) in UNIT_WIDGET_SOURCES:
+        sections.update(WIDGET_SECTIONS)
+    return sections
+
+
+class SnapshotCache:
+    """
+    Caché de /all-data por sección, con cada sección ya serializada a bytes.
+
+    - Cada sección tiene una versión; una ingesta solo invalida (sube la versión de)
+      las secciones cuyas tablas ha tocado.
+    - La respuesta es la concatenación de los blobs cacheados, y su ETag se deriva del
+      contador global de versiones (monótono) más un id de arranque del proceso.
+    - El snapshot completo se guarda también ya comprimido (gzip/br): se comprime una
+      vez por versión, no una vez por petición.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._boot_id = uuid.uuid4().hex[:8]
+        self._version = 1
+        self._versions: Dict[str, int] = {name: 1 for name in SECTION_DEPENDENCIES}
+        self._versions.update({name: 1 for name in SECTIONS})
+        # (sección, compact) -> (versión, bytes)
+        self._blobs: Dict[Tuple[str, bool], Tuple[int, bytes]] = {}
+        # (compact, bundles, encoding pedido) -> (versión global, body completo, encoding aplicado)
+        self._bodies: Dict[Tuple[bool, bool, Optional[str]], Tuple[int, bytes, Optional[str]]] = {}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def section_versions(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._versions)
+
+    def invalidate(self, sections: Iterable[str]) -> Optional[int]:
+        sections = [s for s in sections if s in self._versions]
+        if not sections:
+            return None
+        with self._lock:
+            self._version += 1
+            for section in sections:
+                self._versions[section] = self._version
+                self._blobs.pop((section, False), None)
+                self._blobs.pop((section, True), None)
+            return self._version
+
+    def section_bytes(self, name: str, compact: bool = False) -> Tuple[int, bytes]:
+        # Solo algunas secciones tienen variante columnar; el resto comparte el blob normal
+        key = (name, compact and name in COMPACT_SECTIONS)
+        with self._lock:
+            version = self._versions[name]
+            cached = self._blobs.get(key)
+            if cached and cached[0] == version:
+                return cached
+        blob = encode_json(build_section(name, compact=key[1]))
+        with self._lock:
+            # Si la sección se invalidó mientras se serializaba, no se cachea el blob viejo
+            if self._versions[name] == version:
+                self._blobs[key] = (version, blob)
+        return version, blob
+
+    def etag(self, compact: bool = False, encoding: Optional[str] = None,
+             version: Optional[int] = None, bundles: bool = False) -> str:
+        # Cada variante (compact, bundles, codificación) es una representación distinta: ETag propio
+        version = self._version if version is None else version
+        suffix = ("-c" if compact else "") + ("-b" if bundles else "") + (f"-{encoding}" if encoding else "")
+        return f'"{self._boot_id}-{version}{suffix}"'
+
+    def _assemble(self, sections: Iterable[str], compact: bool, bundles: bool = False) -> bytes:
+        parts = []
+        for name in sections:
+            source = "meta_bundles" if bundles and name == "meta" else name
+            _, blob = self.section_bytes(source, compact)
+            parts.append(b'"' + name.encode("utf-8") + b'":' + blob)
+        return b"{" + b",".join(parts) + b"}"
+
+    def render(self, sections: Iterable[str] = SECTIONS, compact: bool = False) -> Tuple[bytes, str]:
+        """Devuelve (body, etag) ensamblando los blobs de cada sección."""
+        etag = self.etag(compact)
+        return self._assemble(sections, compact), etag
+
+    def render_encoded(self, compact: bool = False, encoding: Optional[str] = None,
+                       bundles: bool = False) -> Tuple[bytes, str, Optional[str]]:
+        """
+        Snapshot completo en la codificación pedida: (body, etag, content-encoding).
+        Plano y comprimido se cachean para la versión global actual.
+        bundles=True: 'meta' lleva solo los hashes de los bundles de referencia.
+        """
+        key = (compact, bundles, encoding)
+        with self._lock:
+            version = self._version
+            cached = self._bodies.get(key)
+            plain = self._bodies.get((compact, bundles, None))
+        if not cached or cached[0] != version:
+            if plain and plain[0] == version:
+                body = plain[1]
+            else:
+                body = self._assemble(SECTIONS, compact, bundles)
+                self._store_body(version, (compact, bundles, None), (version, body, None))
+            used = None
+            if encoding and len(body) >= COMPRESSION_MIN_SIZE:
+                body, used = compress(body, encoding), encoding
+            cached = (version, body, used)
+            self._store_body(version, key, cached)
+        version, body, used = cached
+        return body, self.etag(compact, used, version, bundles), used
+
+    def _store_body(self, version: int, key: Tuple[bool, bool, Optional[str]], entry: tuple):
+        with self._lock:
+            # Una ingesta durante el ensamblado deja este body obsoleto: no se cachea
+            if self._version == version:
+                self._bodies[key] = entry
+
+
+cache = SnapshotCache()
+
+
+@changes.on_commit
+def _invalidate_committed_changes(batch: list):
+    touched = set()
+    for change in batch:
+        touched |= invalidated_sections(change)
+    version = cache.invalidate(touched)
+    if version is not None:
+        log.debug(f"Snapshot v{version}: secciones invalidadas {sorted(touched)}")
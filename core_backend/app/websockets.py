@@ -1,19 +1,259 @@
+import asyncio
+import json
+import logging
+import os
 from fastapi import WebSocket
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+
+try:
+    import msgpack # Opcional: sin el paquete 'msgpack' todos los clientes reciben JSON
+except ImportError:
+    msgpack = None
+
+log = logging.getLogger(__name__)
+
+# Topic por defecto: el delta global de /all-data (clientes que no se suscriben a nada).
+ALL_TOPIC = "all"
+# Topics con parámetro ("unit:<unit_id>", "event:<event_id>", "widget:<sección>") y fijos.
+PARAM_TOPICS = ("unit", "event", "widget")
+FIXED_TOPICS = (ALL_TOPIC, "medal_tally", "schedule", "on_air")
+
+# Mensajes pendientes por conexión antes de aplicar la política de cliente lento.
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# "resync": se vacía su cola y se le pide un snapshot completo. "disconnect": se cierra.
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "resync").lower()
+# Un envío que tarda más que esto se considera conexión muerta.
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+# Keepalive: mensaje 'ping' cada WS_PING_INTERVAL (mantiene vivos proxies y NAT; no exige respuesta).
+# Las conexiones muertas las detecta el ping/pong del protocolo (uvicorn --ws-ping-interval /
+# --ws-ping-timeout, ver start_all.bat) o un envío que falla / supera WS_SEND_TIMEOUT.
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "15"))
+
+PING_MESSAGE = '{"type":"ping"}'
+
+
+class Frame:
+    """
+    Un mensaje de salida. El texto JSON se genera una vez al publicarlo y la versión
+    MessagePack solo si algún destinatario la pide, una sola vez para todos.
+    """
+
+    __slots__ = ("text", "_binary")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._binary = None
+
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = msgpack.packb(json.loads(self.text), use_bin_type=True)
+        return self._binary
+
+
+def decode_binary(data: bytes):
+    """Mensaje binario de un cliente (MessagePack) -> objeto Python."""
+    if msgpack is None:
+        raise ValueError("MessagePack no disponible")
+    return msgpack.unpackb(data, raw=False)
+
+
+def valid_topic(topic) -> bool:
+    if not isinstance(topic, str):
+        return False
+    if topic in FIXED_TOPICS:
+        return True
+    kind, _, value = topic.partition(":")
+    return kind in PARAM_TOPICS and bool(value)
+
+
+class Connection:
+    """Una conexión con su cola de envío acotada, drenada por su propia tarea."""
+
+    def __init__(self, websocket: WebSocket, binary: bool = False):
+        self.websocket = websocket
+        self.binary = binary # Frames MessagePack en lugar de texto JSON
+        self.queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.task = None
+
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        self._loop = None
+        self._connections: Dict[WebSocket, Connection] = {}
+        # Índices de suscripción: topic -> conexiones y conexión -> topics
+        self._subscribers: Dict[str, Set[WebSocket]] = {}
+        self._topics: Dict[WebSocket, Set[str]] = {}
+        # Mensaje para un cliente al que se le han descartado mensajes (lo fija app.deltas)
+        self.resync_message: Optional[Callable[[], str]] = None
+        # Snapshot compartido (app.shared_snapshot): un lector avisa de sus topics y el
+        # escritor suma los de los lectores a los suyos
+        self.subscriptions_changed: Optional[Callable[[Set[str]], None]] = None
+        self.remote_topics: Optional[Callable[[], Set[str]]] = None
 
-    async def connect(self, websocket: WebSocket):
+    async def start(self):
+        """Arranca el keepalive y habilita publish() desde otros hilos."""
+        self._loop = asyncio.get_running_loop()
+        self._loop.create_task(self._heartbeat())
+
+    def publish(self, message: str, topics: Iterable[str] = (ALL_TOPIC,)):
+        """Encola un mensaje para los suscritos a 'topics'. Se puede llamar desde cualquier hilo."""
+        if self._loop is None:
+            return # Sin bucle arrancado (scripts, tests): no hay clientes a los que avisar
+        # call_soon_threadsafe es FIFO: cada cliente recibe los deltas en el orden de sus versiones
+        self._loop.call_soon_threadsafe(self._fan_out, message, tuple(topics))
+
+    async def connect(self, websocket: WebSocket, binary: bool = False) -> bool:
+        """Acepta la conexión. Devuelve si usará MessagePack (binary=True y paquete disponible)."""
         await websocket.accept()
+        if binary and msgpack is None:
+            log.warning("Cliente websocket pide MessagePack pero el paquete no está instalado: se usa JSON")
+            binary = False
+        loop = asyncio.get_running_loop()
+        connection = Connection(websocket, binary)
+        connection.task = loop.create_task(self._sender(connection))
+        self._connections[websocket] = connection
         self.active_connections.append(websocket)
+        self._topics[websocket] = set()
+        self._subscribers.setdefault(ALL_TOPIC, set()).add(websocket)
+        return binary
 
     def disconnect(self, websocket: WebSocket):
+        connection = self._connections.pop(websocket, None)
+        if connection is None:
+            return # Ya desconectada (p. ej. por un envío fallido o por cliente lento)
+        if connection.task is not None and connection.task is not asyncio.current_task():
+            connection.task.cancel()
         self.active_connections.remove(websocket)
+        for topic in self._topics.pop(websocket, set()) | {ALL_TOPIC}:
+            self._unindex(websocket, topic)
+        self._subscriptions_changed()
+
+    # --- Suscripciones ---
+
+    def _unindex(self, websocket: WebSocket, topic: str):
+        subscribers = self._subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(websocket)
+            if not subscribers:
+                del self._subscribers[topic]
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> Set[str]:
+        """
+        Añade topics a una conexión. La primera suscripción explícita sustituye al topic
+        por defecto ('all'), salvo que se pida también.
+        """
+        current = self._topics[websocket]
+        if not current and ALL_TOPIC not in topics:
+            self._unindex(websocket, ALL_TOPIC)
+        for topic in topics:
+            current.add(topic)
+            self._subscribers.setdefault(topic, set()).add(websocket)
+        self._subscriptions_changed()
+        return set(current)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]) -> Set[str]:
+        current = self._topics[websocket]
+        for topic in topics:
+            current.discard(topic)
+            self._unindex(websocket, topic)
+        self._subscriptions_changed()
+        return set(current)
+
+    def _subscriptions_changed(self):
+        if self.subscriptions_changed is not None:
+            try:
+                self.subscriptions_changed(set(self._subscribers) - {ALL_TOPIC})
+            except OSError as e:
+                log.warning(f"No se pudieron publicar las suscripciones de este worker: {e}")
+
+    def _all_topics(self) -> Set[str]:
+        topics = set(self._subscribers)
+        if self.remote_topics is not None:
+            topics |= self.remote_topics() # Clientes de los workers lectores
+        return topics
+
+    def has_subscribers(self, topic: str) -> bool:
+        if self._subscribers.get(topic):
+            return True
+        return self.remote_topics is not None and topic in self.remote_topics()
+
+    def subscribed_values(self, kind: str) -> Set[str]:
+        """Valores con suscriptores de un topic con parámetro (p. ej. unit -> {unit_id, ...})."""
+        prefix = f"{kind}:"
+        return {topic[len(prefix):] for topic in self._all_topics() if topic.startswith(prefix)}
+
+    # --- Envío ---
+
+    def _enqueue(self, websocket: WebSocket, message: Union[Frame, str]):
+        if not isinstance(message, Frame):
+            message = Frame(message)
+        connection = self._connections.get(websocket)
+        if connection is None:
+            return
+        try:
+            connection.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            pass
+        # Cliente lento: no puede frenar al resto ni crecer en memoria sin límite
+        if WS_SLOW_CONSUMER_POLICY == "resync" and self.resync_message is not None:
+            log.warning("Cliente websocket lento: se descartan sus mensajes pendientes y se le pide resync")
+            while not connection.queue.empty():
+                connection.queue.get_nowait()
+            connection.queue.put_nowait(Frame(self.resync_message()))
+        else:
+            log.warning("Cliente websocket lento: se cierra la conexión")
+            self._close(connection)
+
+    def _fan_out(self, message: str, topics: Iterable[str]):
+        # Solo se recorre a los suscritos a alguno de los topics del mensaje; encolar no bloquea
+        recipients = set()
+        for topic in topics:
+            recipients |= self._subscribers.get(topic, set())
+        frame = Frame(message) # Compartido: cada codificación se hace una vez para todos
+        for websocket in recipients:
+            self._enqueue(websocket, frame)
+
+    async def _sender(self, connection: Connection):
+        try:
+            while True:
+                frame = await connection.queue.get()
+                if connection.binary:
+                    send = connection.websocket.send_bytes(frame.binary())
+                else:
+                    send = connection.websocket.send_text(frame.text)
+                await asyncio.wait_for(send, WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.info(f"Conexión websocket cerrada al enviar: {e}")
+            self._close(connection)
+
+    def _close(self, connection: Connection):
+        self.disconnect(connection.websocket)
+        asyncio.get_running_loop().create_task(self._close_socket(connection.websocket))
+
+    @staticmethod
+    async def _close_socket(websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass # Ya estaba cerrada
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            ping = Frame(PING_MESSAGE)
+            for connection in list(self._connections.values()):
+                # Solo keepalive: un cliente que solo escucha y nunca contesta sigue conectado
+                self._enqueue(connection.websocket, ping)
+
+    async def send_personal(self, websocket: WebSocket, message: str):
+        # Por la misma cola que los broadcasts: sin envíos concurrentes sobre un socket
+        self._enqueue(websocket, message)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    async def broadcast(self, message: str, topics: Iterable[str] = (ALL_TOPIC,)):
+        self._fan_out(message, topics)
 
 manager = ConnectionManager()
@@ -0,0 +1,243 @@
+import logging
+import threading
+from typing import Dict
+
+from . import changes
+from .read_model import model as read_model
+from .record_index import index as record_index, is_relay_event
+
+log = logging.getLogger(__name__)
+
+# Secciones de /all-data que se calculan por unidad y por prueba.
+UNIT_WIDGETS = (
+    "event_id", "lane_id", "team_id", "start_list_ind", "start_list_team",
+    "winner_id", "results_widget", "qualifiers",
+)
+EVENT_WIDGETS = ("phase_summary", "medal_list", "raising_flags")
+WIDGET_SECTIONS = UNIT_WIDGETS + EVENT_WIDGETS
+
+MEDAL_ORDER = {"G": 0, "S": 1, "B": 2}
+
+# Cambios en estas tablas afectan a nombres/banderas de cualquier widget.
+_GLOBAL_TABLES = ("participants", "nocs", "events")
+
+
+def _sort_by_rank(row: dict):
+    return (row.get("rank") is None, row.get("rank") or 0, row.get("time_hs") is None, row.get("time_hs") or 0)
+
+
+class WidgetPayloads:
+    """
+    Payloads listos para cada overlay (nombres, NOC, bandera, calle, puesto y récord ya unidos),
+    calculados desde el read model y cacheados por unidad / prueba hasta que esta cambie.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._units: Dict[str, dict] = {}
+        self._events: Dict[str, dict] = {}
+        self._generation = 0 # Sube en cada invalidación: un payload calculado antes no se cachea
+
+    # --- Helpers de unión ---
+
+    def _competitor(self, participant_id: str) -> dict:
+        participant = read_model.get("participants", participant_id) or {}
+        noc = participant.get("noc")
+        noc_row = read_model.get("nocs", noc) if noc else None
+        return {
+            "participant_id": participant_id,
+            "name": participant.get("name"),
+            "noc": noc,
+            "noc_name": noc_row.get("long_name") if noc_row else None,
+            "flag": noc_row.get("flag_url_cloud") if noc_row else None,
+        }
+
+    @staticmethod
+    def _members(composition) -> list:
+        members = []
+        for athlete in sorted(composition or [], key=lambda a: int(a.get("Order") or 0)):
+            name = f"{athlete.get('GivenName') or ''} {athlete.get('FamilyName') or ''}".strip()
+            members.append({"code": athlete.get("Code"), "order": athlete.get("Order"), "name": name})
+        return members
+
+    # --- Por unidad ---
+
+    def _build_unit(self, unit_id: str) -> dict:
+        unit = read_model.get("schedule", unit_id) or {"unit_id": unit_id}
+        event = read_model.get("events", unit.get("event_id")) or {}
+
+        start_list = sorted(
+            read_model.unit_rows("start_list_entries", unit_id),
+            key=lambda s: (s.get("lane") is None, s.get("lane") or 0),
+        )
+        lanes = {s["participant_id"]: s.get("lane") for s in start_list}
+
+        # ODF manda Composition también para los individuales (un solo Athlete, Order="1"):
+        # equipo = prueba de relevos o más de un integrante
+        relay = is_relay_event(unit.get("event_id"))
+        lane_rows, team_rows = [], []
+        for entry in start_list:
+            row = {"lane": entry.get("lane"), **self._competitor(entry["participant_id"])}
+            if relay or len(entry.get("composition") or []) > 1:
+                row["members"] = self._members(entry.get("composition"))
+                team_rows.append(row)
+            else:
+                lane_rows.append(row)
+
+        detections = {}
+        for det in record_index.new_record_section().get(unit_id, []):
+            if det["kind"] in ("NEW_RECORD", "EQUAL_RECORD"):
+                detections.setdefault(det["participant_id"], det["record_type"])
+
+        results = []
+        for res in sorted(read_model.unit_results(unit_id), key=_sort_by_rank):
+            results.append({
+                "rank": res.get("rank"),
+                "lane": lanes.get(res["participant_id"]),
+                **self._competitor(res["participant_id"]),
+                "time": res.get("time"),
+                "time_hs": res.get("time_hs"),
+                "diff": res.get("diff"),
+                "irm": res.get("irm"),
+                "qualification": res.get("qualification_mark"),
+                "record": res.get("record_mark") or "",
+                "splits": res.get("splits"),
+                # Récord detectado por el backend antes de que el feed envíe la marca oficial
+                "record_pending": detections.get(res["participant_id"]) if not res.get("record_mark") else None,
+            })
+
+        return {
+            "event_id": {
+                "unit_id": unit_id,
+                "unit_name": unit.get("name"),
+                "event_id": unit.get("event_id"),
+                "event_name": event.get("name"),
+                "phase": unit.get("phase"),
+                "status": unit.get("status"),
+                "start_time": unit["start_time"].isoformat() if unit.get("start_time") else None,
+            },
+            "lane_id": lane_rows + team_rows,
+            "team_id": team_rows,
+            "start_list_ind": lane_rows,
+            "start_list_team": [
+                {"lane": t["lane"], "team_name": t["name"], "noc": t["noc"], "flag": t["flag"], "members": t["members"]}
+                for t in team_rows
+            ],
+            "winner_id": next((r for r in results if r["rank"] == 1), None),
+            "results_widget": results,
+            "qualifiers": [r for r in results if r["qualification"]],
+        }
+
+    def unit(self, unit_id: str) -> dict:
+        with self._lock:
+            cached = self._units.get(unit_id)
+            generation = self._generation
+        if cached is not None:
+            return cached
+        payload = self._build_unit(unit_id)
+        with self._lock:
+            if generation == self._generation:
+                self._units[unit_id] = payload
+        return payload
+
+    # --- Por prueba ---
+
+    def _build_event(self, event_id: str) -> dict:
+        units = [u for u in read_model.rows("schedule") if u.get("event_id") == event_id]
+
+        phase_summary = {}
+        for unit in sorted(units, key=lambda u: (u.get("start_time") is None, u.get("start_time") or 0)):
+            rows = phase_summary.setdefault(unit.get("phase") or "Unknown", [])
+            rows.extend(self.unit(unit["unit_id"])["results_widget"])
+        for phase, rows in phase_summary.items():
+            rows.sort(key=lambda r: (r["time_hs"] is None, r["time_hs"] or 0))
+
+        medallists = sorted(
+            (m for m in read_model.rows("medallists") if m.get("event_id") == event_id),
+            key=lambda m: MEDAL_ORDER.get(m.get("medal_type"), 9),
+        )
+        medal_list = [{"medal_type": m["medal_type"], **self._competitor(m["participant_id"])} for m in medallists]
+
+        return {
+            "phase_summary": phase_summary,
+            "medal_list": medal_list,
+            "raising_flags": [{"medal_type": m["medal_type"], "noc": m["noc"], "flag": m["flag"]} for m in medal_list],
+        }
+
+    def event(self, event_id: str) -> dict:
+        with self._lock:
+            cached = self._events.get(event_id)
+            generation = self._generation
+        if cached is not None:
+            return cached
+        payload = self._build_event(event_id)
+        with self._lock:
+            if generation == self._generation:
+                self._events[event_id] = payload
+        return payload
+
+    # --- Secciones de /all-data ---
+
+    def build_section(self, name: str) -> dict:
+        if name in UNIT_WIDGETS:
+            unit_ids = {u["unit_id"] for u in read_model.rows("schedule")}
+            return {
+                unit_id: self.unit(unit_id)[name] for unit_id in sorted(unit_ids)
+                if read_model.unit_rows("start_list_entries", unit_id) or read_model.unit_results(unit_id)
+            }
+        event_ids = {u.get("event_id") for u in read_model.rows("schedule")} | {
+            m.get("event_id") for m in read_model.rows("medallists")
+        }
+        event_ids.discard(None)
+        return {event_id: self.event(event_id)[name] for event_id in sorted(event_ids)}
+
+    # --- Invalidación ---
+
+    def invalidate(self, unit_ids=(), event_ids=(), everything=False):
+        with self._lock:
+            self._generation += 1
+            if everything or not read_model.active:
+                # Sin read model no hay nada cacheado (y buscar la prueba lo cargaría)
+                self._units.clear()
+                self._events.clear()
+                return
+            for unit_id in unit_ids:
+                self._units.pop(unit_id, None)
+                unit = read_model.get("schedule", unit_id)
+                if unit and unit.get("event_id"):
+                    self._events.pop(unit["event_id"], None)
+            for event_id in event_ids:
+                self._events.pop(event_id, None)
+
+
+payloads = WidgetPayloads()
+
+
+def affected_units_and_events(batch: list):
+    """Unidades y pruebas que toca un lote de cambios (None = afecta a todo)."""
+    unit_ids, event_ids = set(), set()
+    for change in batch:
+        table = change.get("table")
+        if table in _GLOBAL_TABLES or change["kind"] == "reload":
+            return None
+        if change["kind"] == "record_breaks":
+            unit_ids.add(change["unit_id"])
+        elif change["kind"] == "delete":
+            if "unit_id" in change.get("match", {}):
+                unit_ids.add(change["match"]["unit_id"])
+        elif change["kind"] == "rows":
+            for row in change["rows"]:
+                if row.get("unit_id"):
+                    unit_ids.add(row["unit_id"])
+                if table == "medallists" and row.get("event_id"):
+                    event_ids.add(row["event_id"])
+    return unit_ids, event_ids
+
+
+@changes.on_commit
+def _invalidate_committed_changes(batch: list):
+    affected = affected_units_and_events(batch)
+    if affected is None:
+        payloads.invalidate(everything=True)
+    else:
+        payloads.invalidate(unit_ids=affected[0], event_ids=affected[1])
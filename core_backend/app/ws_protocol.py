@@ -0,0 +1,131 @@
+import json
+import logging
+
+from fastapi import WebSocket
+from starlette.concurrency import run_in_threadpool
+
+from . import database, json_generator, read_model, snapshot_cache
+from .deltas import delta_log
+from .reference_bundles import bundles as reference_bundles
+from .shared_snapshot import shared
+from .websockets import decode_binary, manager, valid_topic
+
+log = logging.getLogger(__name__)
+
+# Mensajes que entiende /ws (cliente -> servidor). Las respuestas van solo a quien pregunta.
+#   {"type": "subscribe" | "unsubscribe", "topics": [...]}
+#   {"type": "snapshot", "compact": bool, "bundles": bool, "sections": [...]}
+#   {"type": "version"}
+#   {"type": "resync", "boot": str, "since": int}
+#   {"type": "ping"}  /  {"type": "pong"} (respuesta al keepalive del servidor, opcional)
+# Con /ws?encoding=msgpack los frames de datos van en MessagePack (binario) en vez de JSON,
+# y el cliente puede enviar sus mensajes en cualquiera de los dos formatos.
+
+
+def _reply(payload: dict) -> str:
+    return json_generator.encode_json(payload).decode("utf-8")
+
+
+def build_snapshot(compact: bool = False, bundles: bool = False, sections=None) -> str:
+    """
+    Mensaje 'snapshot' con el contenido de /all-data (o solo 'sections'), desde la caché de
+    snapshot del read model. 'version' es la del último delta ya incluido.
+    En un lector del snapshot compartido, desde los segmentos del escritor (con su boot / versión).
+    """
+    boot, version = delta_log.boot_id, delta_log.version # Antes de renderizar: el snapshot es al menos así de nuevo
+    published = None
+    if shared.is_reader and read_model.READ_MODEL_ENABLED:
+        published = shared.read_sections(sections, compact) if sections else shared.read(compact, bundles, None)
+    if published is not None:
+        body, boot, version = published[0], published[-2], published[-1]
+    elif read_model.READ_MODEL_ENABLED:
+        if sections:
+            body, _ = snapshot_cache.cache.render(sections, compact=compact)
+        else:
+            body, _, _ = snapshot_cache.cache.render_encoded(compact=compact, bundles=bundles)
+    else:
+        db = database.ReadSessionLocal()
+        try:
+            data = json_generator.generate_json(db, compact=compact)
+        finally:
+            db.close()
+        if bundles:
+            data["meta"] = {"bundles": reference_bundles.refs()}
+        if sections:
+            data = {name: data[name] for name in sections if name in data}
+        body = json_generator.encode_json(data)
+    head = {"type": "snapshot", "boot": boot, "version": version}
+    if sections:
+        head["sections"] = sections
+    return (json_generator.encode_json(head)[:-1] + b',"data":' + body + b"}").decode("utf-8")
+
+
+async def send_snapshot(websocket: WebSocket, compact: bool = False, bundles: bool = False, sections=None):
+    # Un snapshot no cacheado se construye fuera del bucle de eventos
+    message = await run_in_threadpool(build_snapshot, compact, bundles, sections)
+    await manager.send_personal(websocket, message)
+
+
+async def handle_message(websocket: WebSocket, data):
+    """Procesa un mensaje de un cliente (texto JSON o binario MessagePack). Nada se reenvía a otros clientes."""
+    try:
+        message = decode_binary(data) if isinstance(data, bytes) else json.loads(data)
+    except Exception:
+        message = None
+    if not isinstance(message, dict):
+        await manager.send_personal(websocket, _reply({"type": "error", "error": "Invalid message"}))
+        return
+    kind = message.get("type")
+
+    if kind == "pong":
+        return
+
+    if kind == "ping":
+        await manager.send_personal(websocket, _reply({"type": "pong"}))
+        return
+
+    if kind == "version":
+        await manager.send_personal(websocket, _reply({"type": "version", "boot": delta_log.boot_id, "version": delta_log.version}))
+        return
+
+    if kind == "snapshot":
+        sections = message.get("sections")
+        if sections is not None:
+            if not isinstance(sections, list):
+                sections = []
+            sections = [name for name in sections if name in read_model.SECTIONS]
+        await send_snapshot(websocket, bool(message.get("compact")), bool(message.get("bundles")), sections)
+        return
+
+    if kind == "resync":
+        # Handshake de resync: deltas perdidos, o aviso de que hace falta un snapshot completo
+        since = message.get("since")
+        missed = delta_log.since(since, message.get("boot")) if isinstance(since, int) else None
+        for delta in missed if missed is not None else [delta_log.resync_required()]:
+            await manager.send_personal(websocket, delta)
+        return
+
+    if kind in ("subscribe", "unsubscribe"):
+        # Topics: unit:<id>, event:<id>, medal_tally, schedule, on_air, widget:<sección>, all
+        topics = message.get("topics") or []
+        if not isinstance(topics, list):
+            topics = [topics]
+        invalid = [t for t in topics if not valid_topic(t)]
+        if invalid:
+            reply = {"type": "error", "error": "Invalid topics", "topics": invalid}
+        elif kind == "subscribe":
+            reply = {"type": "subscribed", "topics": sorted(manager.subscribe(websocket, topics))}
+        else:
+            reply = {"type": "subscribed", "topics": sorted(manager.unsubscribe(websocket, topics))}
+        await manager.send_personal(websocket, _reply(reply))
+        return
+
+    await manager.send_personal(websocket, _reply({"type": "error", "error": "Unknown message type", "message_type": kind}))
+
+
+async def open_session(websocket: WebSocket, snapshot: bool, compact: bool, bundles: bool):
+    """Al conectar: snapshot inicial por el propio socket (o solo la versión, si no se quiere)."""
+    if snapshot:
+        await send_snapshot(websocket, compact, bundles)
+    else:
+        await manager.send_personal(websocket, delta_log.hello())
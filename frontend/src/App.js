@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import './App.css';
 
@@ -23,31 +23,205 @@ import MedalTallyWidget from './components/MedalTallyWidget';
 import RaisingFlagsWidget from './components/RaisingFlagsWidget';
 import ChampionshipInfoWidget from './components/ChampionshipInfoWidget';
 
+const API_URL = 'http://localhost:8000';
+const WS_URL = 'ws://localhost:8000/ws?bundles=true';
+// Reconexión del socket: espera exponencial entre intentos, con tope
+const RECONNECT_BASE_MS = 500;
+const RECONNECT_MAX_MS = 15000;
+// Espera antes de volver a pedir un snapshot cuyos bundles no se pudieron descargar
+const SNAPSHOT_RETRY_MS = 1000;
+
 function App() {
   const [data, setData] = useState(null);
+  // Bundles de referencia ya descargados, por URL (la URL lleva el hash: nunca caducan)
+  const bundleCache = useRef({});
+
+  // Reconstruye 'meta' (events, units, participants, nocs) a partir de las refs de bundles
+  const resolveBundles = async (refs) => {
+    const meta = {};
+    await Promise.all(Object.entries(refs).map(async ([name, ref]) => {
+      if (!bundleCache.current[ref.url]) {
+        const response = await axios.get(API_URL + ref.url);
+        bundleCache.current[ref.url] = response.data;
+      }
+      meta[name] = bundleCache.current[ref.url];
+    }));
+    // Solo se guardan las versiones vigentes: las de hashes anteriores ya no se vuelven a pedir
+    const current = new Set(Object.values(refs).map(ref => ref.url));
+    Object.keys(bundleCache.current).forEach(url => {
+      if (!current.has(url)) {
+        delete bundleCache.current[url];
+      }
+    });
+    return meta;
+  };
+
+  // Versión de los deltas ya aplicados ({boot, version} del servidor)
+  const deltaVersion = useRef({ boot: null, version: 0 });
+  const resyncPending = useRef(false);
+  // Deltas recibidos mientras llega/se prepara el snapshot: se aplican encima al terminar
+  const queuedDeltas = useRef([]);
 
-  const fetchData = () => {
-    axios.get('http://localhost:8000/all-data')
-      .then(response => {
-        setData(response.data);
-      })
-      .catch(error => {
-        console.error('Error fetching data:', error);
+  // Aplica los cambios de un delta: filas completas por unidad o filas sueltas de medallistas
+  const applyChanges = (prev, changes) => {
+    const next = { ...prev };
+    changes.forEach(change => {
+      if (change.unit_id) {
+        next[change.section] = (next[change.section] || [])
+          .filter(row => row.unit_id !== change.unit_id)
+          .concat(change.rows);
+      } else {
+        const keys = new Set(change.rows.map(row => `${row.event_id}|${row.participant_id}`));
+        next[change.section] = (next[change.section] || [])
+          .filter(row => !keys.has(`${row.event_id}|${row.participant_id}`))
+          .concat(change.rows);
+      }
+    });
+    return next;
+  };
+
+  // Payloads de widgets de las unidades / pruebas tocadas: reemplazan su entrada en cada sección
+  const applyWidgets = (prev, widgets) => {
+    const next = { ...prev };
+    [widgets.units || {}, widgets.events || {}].forEach(byId => {
+      Object.entries(byId).forEach(([id, payload]) => {
+        Object.entries(payload).forEach(([section, value]) => {
+          next[section] = { ...(next[section] || {}), [id]: value };
+        });
       });
+    });
+    return next;
   };
 
   useEffect(() => {
-    fetchData();
+    // El snapshot inicial llega por el propio socket (con 'meta' como refs de bundles)
+    let ws = null;
+    let unmounted = false;
+    let reconnectTimer = null;
+    let snapshotTimer = null;
+    let attempts = 0;
+    const send = (message) => {
+      if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify(message));
+      }
+    };
+
+    const applyDelta = (delta) => {
+      if (queuedDeltas.current) {
+        queuedDeltas.current.push(delta);
+        return;
+      }
+      const current = deltaVersion.current;
+      if (delta.boot !== current.boot || delta.version <= current.version) {
+        return;
+      }
+      if (delta.base !== current.version) {
+        // Hueco de versiones: pedimos al servidor lo que falta
+        if (!resyncPending.current) {
+          resyncPending.current = true;
+          send({ type: 'resync', boot: current.boot, since: current.version });
+        }
+        return;
+      }
+      resyncPending.current = false;
+      deltaVersion.current = { boot: delta.boot, version: delta.version };
+      if (delta.changes.length) {
+        setData(prev => (prev ? applyChanges(prev, delta.changes) : prev));
+      }
+      if (delta.widgets) {
+        setData(prev => (prev ? applyWidgets(prev, delta.widgets) : prev));
+      }
+      if (delta.sections.length) {
+        // Solo las secciones derivadas que indica el delta
+        send({ type: 'snapshot', sections: delta.sections });
+      }
+      if (delta.bundles) {
+        resolveBundles(delta.bundles)
+          .then(meta => setData(prev => (prev ? { ...prev, meta } : prev)))
+          .catch(error => console.error('Error fetching bundles:', error));
+      }
+    };
 
-    const ws = new WebSocket('ws://localhost:8000/ws');
-    ws.onmessage = (event) => {
-      if (event.data === 'data updated') {
-        fetchData();
+    const applySnapshot = async (message) => {
+      if (message.sections) {
+        setData(prev => (prev ? { ...prev, ...message.data } : prev));
+        return;
+      }
+      const socket = ws;
+      let meta;
+      try {
+        meta = await resolveBundles(message.data.meta.bundles);
+      } catch (error) {
+        console.error('Error fetching bundles:', error);
+      }
+      if (socket !== ws) {
+        return; // Conexión ya reemplazada: la nueva recibe su propio snapshot
+      }
+      if (!meta) {
+        // Sin snapshot aplicado la versión no avanza: los deltas siguen en cola hasta el reintento
+        snapshotTimer = setTimeout(() => send({ type: 'snapshot', bundles: true }), SNAPSHOT_RETRY_MS);
+        return;
       }
+      setData({ ...message.data, meta });
+      resyncPending.current = false;
+      deltaVersion.current = { boot: message.boot, version: message.version };
+      const queued = queuedDeltas.current || [];
+      queuedDeltas.current = null;
+      queued.forEach(applyDelta);
     };
 
+    const handleMessage = (event) => {
+      let message;
+      try {
+        message = JSON.parse(event.data);
+      } catch (e) {
+        return;
+      }
+      if (message.type === 'ping') {
+        // Heartbeat del servidor: sin respuesta, cierra la conexión
+        send({ type: 'pong' });
+      } else if (message.type === 'snapshot') {
+        if (!message.sections) {
+          attempts = 0; // Conexión útil: la próxima caída vuelve a empezar por la espera mínima
+        }
+        applySnapshot(message);
+      } else if (message.type === 'resync_required') {
+        // El servidor ya no tiene los deltas perdidos: snapshot completo por el socket
+        queuedDeltas.current = queuedDeltas.current || [];
+        send({ type: 'snapshot', bundles: true });
+      } else if (message.type === 'delta') {
+        applyDelta(message);
+      }
+    };
+
+    const connect = () => {
+      // Cada conexión nueva recibe un snapshot completo: hasta entonces los deltas se encolan
+      queuedDeltas.current = [];
+      resyncPending.current = false;
+      clearTimeout(snapshotTimer);
+      const socket = new WebSocket(WS_URL);
+      ws = socket;
+      socket.onmessage = handleMessage;
+      // Un error (también al no poder conectar) acaba en onclose, que programa el reintento
+      socket.onerror = () => socket.close();
+      socket.onclose = () => {
+        if (unmounted || ws !== socket) {
+          return;
+        }
+        const delay = Math.min(RECONNECT_MAX_MS, RECONNECT_BASE_MS * 2 ** attempts);
+        attempts += 1;
+        reconnectTimer = setTimeout(connect, delay);
+      };
+    };
+    connect();
+
     return () => {
-      ws.close();
+      unmounted = true;
+      clearTimeout(reconnectTimer);
+      clearTimeout(snapshotTimer);
+      if (ws) {
+        ws.close();
+      }
     };
   }, []);
 
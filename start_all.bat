@@ -13,7 +13,7 @@ set "BASE_DIR=%~dp0"
 
 REM --- 1. Start Core Backend ---
 echo Launching Core Backend...
-start "ODF Backend" cmd /k "call "%BASE_DIR%venv\Scripts\activate.bat" && cd /d "%BASE_DIR%core_backend" && uvicorn app.main:app --host 0.0.0.0 --port 8000"
+start "ODF Backend" cmd /k "call "%BASE_DIR%venv\Scripts\activate.bat" && cd /d "%BASE_DIR%core_backend" && uvicorn app.main:app --host 0.0.0.0 --port 8000 --ws websockets --ws-per-message-deflate true --ws-ping-interval 15 --ws-ping-timeout 45"
 
 REM Give Windows a moment to process
 timeout /t 3 /nobreak > nul